@@ -0,0 +1,138 @@
+"""
+Offline stand-in for the Eventbrite API, mounted as a requests transport
+adapter with tap_eventbrite.client.mount(). Payloads are generated from the
+tap's own schemas, so every dotted property is present in the records.
+"""
+import datetime
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+
+from requests.adapters import BaseAdapter
+from tap_eventbrite import load_schemas
+
+START = datetime.datetime(2020, 1, 1)
+
+def make_value(schema_property, index):
+    """A value of the right type for one schema property"""
+    if schema_property.get('format') == 'date-time':
+        return (START + datetime.timedelta(minutes=index)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    schema_type = schema_property['type'][1]
+    if schema_type == "integer":
+        return index
+    if schema_type == "boolean":
+        return index % 2 == 0
+    return "value-{}".format(index)
+
+def make_record(schema, index):
+    """Nested record shaped like the dotted keys of a schema"""
+    record = {}
+    for schema_key, schema_property in schema['properties'].items():
+        path = schema_key.split(".")
+        parent = record
+        for key in path[:-1]:
+            parent = parent.setdefault(key, {})
+        parent[path[-1]] = make_value(schema_property, index)
+    return record
+
+class FakeEventbriteAdapter(BaseAdapter):
+    """
+    Serves paginated events, attendees, orders, categories, subcategories and
+    sales reports. latency is added to every response, error_rate is the share
+    of calls answered with a 429 and a Retry-After of retry_after seconds.
+    """
+    def __init__(self, events=100, attendees=10000, orders=5000, categories=20, subcategories=200,
+                 report_days=30, page_size=50, latency=0.0, error_rate=0.0, retry_after=0, seed=0):
+        super().__init__()
+        self.volumes = {
+            'events': events,
+            'attendees': attendees,
+            'orders': orders,
+            'categories': categories,
+            'subcategories': subcategories,
+        }
+        self.report_days = report_days
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.schemas = load_schemas()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            self.requests += 1
+            throttle = self.random.random() < self.error_rate
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if throttle:
+            with self.lock:
+                self.throttled += 1
+            return self.response(request, 429, {'error': 'HIT_RATE_LIMIT'}, {'Retry-After': str(self.retry_after)})
+
+        url = urllib.parse.urlparse(request.url)
+        query = urllib.parse.parse_qs(url.query)
+        stream_id = [part for part in url.path.split("/") if part][-1]
+
+        if stream_id == "sales":
+            return self.response(request, 200, self.sales_report(query['event_ids'][0].split(","), 'group_by' in query))
+        if stream_id not in self.volumes:
+            return self.response(request, 404, {'error': 'NOT_FOUND'})
+        return self.response(request, 200, self.page(stream_id, query))
+
+    def page(self, stream_id, query):
+        page_size = int(query.get('page_size', [self.page_size])[0])
+        first = int(query.get('continuation', ["0"])[0])
+        if 'changed_since' in query:
+            # Record n changed n minutes after START, so the list is in changed order
+            since = datetime.datetime.strptime(query['changed_since'][0][:19], "%Y-%m-%dT%H:%M:%S")
+            first = max(first, -(-int((since - START).total_seconds()) // 60))
+        last = min(first + page_size, self.volumes[stream_id])
+
+        records = []
+        for index in range(first, last):
+            record = make_record(self.schemas[stream_id], index)
+            record['id'] = "{}".format(index)
+            records.append(record)
+
+        pagination = {'object_count': self.volumes[stream_id], 'has_more_items': last < self.volumes[stream_id]}
+        if pagination['has_more_items']:
+            pagination['continuation'] = str(last)
+        return {stream_id: records, 'pagination': pagination}
+
+    def sales_report(self, event_ids, grouped):
+        rows = []
+        for day in range(self.report_days):
+            date = (START + datetime.timedelta(days=day)).strftime("%Y-%m-%dT%H:%M:%S")
+            totals = {'currency': 'USD', 'gross': '10.00', 'net': '9.00', 'quantity': day, 'fees': '1.00'}
+            row = {'date': date, 'date_localized': date, 'totals': totals}
+            if grouped:
+                row['breakdown'] = [{'name': event_id, 'totals': totals} for event_id in event_ids]
+            rows.append(row)
+        return {'event_ids': event_ids, 'data': rows}
+
+    def response(self, request, status_code, body, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response.url = request.url
+        response.request = request
+        response._content = json.dumps(body).encode()
+        response.headers['Content-Type'] = 'application/json'
+        response.headers.update(headers or {})
+        with self.lock:
+            self.bytes_sent += len(response._content)
+        return response
+
+    def close(self):
+        pass
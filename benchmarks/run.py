@@ -0,0 +1,125 @@
+"""
+Offline benchmarks of the tap against the fake Eventbrite API.
+
+    python -m benchmarks.run --attendees 50000 --latency 0.05 --error-rate 0.01
+
+Runs a full sync() with every stream selected, then parse_date on its own,
+and reports records/sec, requests issued, peak RSS and wall time. Singer
+output goes to a counting sink instead of stdout.
+"""
+import argparse
+import json
+import resource
+import sys
+import time
+
+import tap_eventbrite
+
+from tap_eventbrite import client
+from benchmarks.fake_api import FakeEventbriteAdapter, make_record
+
+class CountingSink():
+    """Stands in for stdout, counts Singer messages, RECORD messages and bytes"""
+    def __init__(self):
+        self.messages = 0
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, text):
+        self.messages += text.count("\n")
+        self.records += text.count('{"type": "RECORD"') + text.count('{"type":"RECORD"')
+        self.bytes += len(text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def bench_parse_date(stream_id, count):
+    schema = tap_eventbrite.load_schemas()[stream_id]
+    records = [make_record(schema, index) for index in range(count)]
+    compiled_schema = tap_eventbrite.compile_schema(schema)
+
+    start = time.perf_counter()
+    for record in records:
+        tap_eventbrite.parse_date(schema, record, compiled_schema)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'benchmark': 'parse_date',
+        'stream': stream_id,
+        'records': count,
+        'wall_seconds': round(elapsed, 3),
+        'records_per_second': round(count / elapsed),
+    }
+
+def bench_sync(adapter, config):
+    client.mount(adapter)
+    catalog = tap_eventbrite.sort_catalog(tap_eventbrite.discover())
+
+    sink = CountingSink()
+    stdout = sys.stdout
+    sys.stdout = sink
+    start = time.perf_counter()
+    try:
+        tap_eventbrite.sync(config, {}, catalog)
+    finally:
+        sys.stdout = stdout
+        client.mount(None)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'benchmark': 'sync',
+        'messages': sink.messages,
+        'records': sink.records,
+        'output_bytes': sink.bytes,
+        'requests': adapter.requests,
+        'throttled_responses': adapter.throttled,
+        'downloaded_bytes': adapter.bytes_sent,
+        'wall_seconds': round(elapsed, 3),
+        'records_per_second': round(sink.records / elapsed),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=100)
+    parser.add_argument('--attendees', type=int, default=10000)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--subcategories', type=int, default=200)
+    parser.add_argument('--report-days', type=int, default=30)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of responses that are a 429")
+    parser.add_argument('--parse-date-records', type=int, default=20000)
+    parser.add_argument('--config', default="{}", help="JSON merged into the tap config")
+    args = parser.parse_args()
+
+    config = {
+        'EVENTBRITE_TOKEN': 'benchmark',
+        'ORG_ID': '1',
+        'RUN_DAILY': False,
+        'HTTP_BACKOFF_FACTOR': 0.01,
+    }
+    config.update(json.loads(args.config))
+
+    adapter = FakeEventbriteAdapter(
+        events=args.events, attendees=args.attendees, orders=args.orders,
+        categories=args.categories, subcategories=args.subcategories,
+        report_days=args.report_days, page_size=args.page_size,
+        latency=args.latency, error_rate=args.error_rate)
+
+    # sync first, so its peak RSS is not inflated by the parse_date records
+    results = [
+        bench_sync(adapter, config),
+        bench_parse_date('attendees', args.parse_date_records),
+    ]
+    for result in results:
+        print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Startup benchmark of the tap, each measure in a fresh interpreter.
+
+    python -m benchmarks.startup --runs 20
+
+Reports the median wall time of importing singer-python alone (the floor
+every Singer tap pays), of importing tap_eventbrite and of a full
+`tap-eventbrite --discover`, then, inside one interpreter, what importing the
+tap adds on top of singer and what discover() costs.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DISCOVER = """
+import sys
+import tap_eventbrite
+sys.argv = ["tap-eventbrite", "-c", sys.argv[1], "--discover"]
+tap_eventbrite.main()
+"""
+
+IN_PROCESS = """
+import json
+import time
+started = time.perf_counter()
+import singer
+singer_imported = time.perf_counter()
+import tap_eventbrite
+imported = time.perf_counter()
+tap_eventbrite.sort_catalog(tap_eventbrite.discover())
+print(json.dumps([singer_imported - started, imported - singer_imported, time.perf_counter() - imported]))
+"""
+
+def wall_ms(arguments, runs):
+    """Median wall time of a Python command, in milliseconds"""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(times), 1)
+
+def in_process_ms(runs):
+    """
+    Median times measured inside the interpreter, in milliseconds: importing
+    singer, then importing the tap on top of it, then discover()
+    """
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", IN_PROCESS], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        timings.append(json.loads(result.stdout))
+    return [round(statistics.median(timing) * 1000, 2) for timing in zip(*timings)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix=".json", delete=False) as file:
+        json.dump({'EVENTBRITE_TOKEN': 'benchmark', 'ORG_ID': '1', 'RUN_DAILY': False}, file)
+        config_path = file.name
+
+    try:
+        singer_ms, tap_ms, discover_ms = in_process_ms(args.runs)
+        result = {
+            'benchmark': 'startup',
+            'runs': args.runs,
+            'python_ms': wall_ms(["-c", "pass"], args.runs),
+            'import_singer_ms': wall_ms(["-c", "import singer"], args.runs),
+            'import_tap_ms': wall_ms(["-c", "import tap_eventbrite"], args.runs),
+            'discover_command_ms': wall_ms(["-c", DISCOVER, config_path], args.runs),
+            'singer_import_in_process_ms': singer_ms,
+            'tap_import_after_singer_ms': tap_ms,
+            'discover_in_process_ms': discover_ms,
+        }
+    finally:
+        os.remove(config_path)
+
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
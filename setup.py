@@ -13,6 +13,11 @@ setup(
         "singer-python>=5.0.12",
         "requests",
     ],
+    extras_require={
+        "fast": ["orjson"],
+        "async": ["aiohttp"],
+        "parquet": ["pyarrow"],
+    },
     entry_points="""
     [console_scripts]
     tap-eventbrite=tap_eventbrite:main
@@ -1,36 +1,50 @@
 #!/usr/bin/env python3
 import os
 import json
+import asyncio
 import singer
-import datetime
+
+from concurrent.futures import ThreadPoolExecutor
 
 from singer import utils, metadata
-from tap_eventbrite.event import events_call
-from tap_eventbrite.attendee import attendees_call
-from tap_eventbrite.sales_report import sales_report_call
-from tap_eventbrite.order import orders_call
-from tap_eventbrite.category import categories_call
-from tap_eventbrite.subcategory import subcategories_call
+from tap_eventbrite import backfill, dedup, organizations, output, telemetry
+from tap_eventbrite.concurrency import ordered_map
+from tap_eventbrite.pagination import get_page_sizer, DEFAULT_PREFETCH
+# Shared with the async engine and the backfills, and kept importable from here
+from tap_eventbrite.streams import (
+    STREAMS, EVENTS, DEFAULT_CHECKPOINT_EVERY_PAGES, RECORD_BATCH_SIZE, STREAMED_RECORD_BATCH_SIZE, DEFAULT_DATE_TIME,
+    sync_stitch_data, PageWriter, sync_paginated, write_pages, SalesReportWriter, start_stream, finish_stream,
+    get_events, record_batch_size, batches, check_response, get_changed_since, max_bookmark,
+    get_threshold_time_formatted, compile_schema, get_expansions, filter_window, parse_date)
+
+# The HTTP client and the endpoint modules (tap_eventbrite.client, .event,
+# .attendee, ...) are imported by the code that uses them, so --discover does
+# not load them.
+
+# ORG_ID and EVENTBRITE_TOKEN, or ORGANIZATIONS, see tap_eventbrite.organizations
+REQUIRED_CONFIG_KEYS = ["RUN_DAILY"]
 
-EVENTS_LIST = [] # User for sales reports table!
+SCHEMAS = {} # Loaded once per process by load_schemas()
+
+# Eventbrite allows 2,000 calls per hour per token, so a few report calls in
+# flight is plenty; more would only burn the hourly quota faster.
+MAX_SALES_REPORTS_CONCURRENCY = 8
 
-REQUIRED_CONFIG_KEYS = ["EVENTBRITE_TOKEN", "RUN_DAILY", "ORG_ID"]
 LOGGER = singer.get_logger()
 
 def get_abs_path(path):
     return os.path.join(os.path.dirname(os.path.realpath(__file__)), path)
 
 def load_schemas():
-    """Load schemas from schemas folder"""
-    schemas = {}
-
-    for filename in os.listdir(get_abs_path('schemas')):
-        path = get_abs_path('schemas') + '/' + filename
-        file_raw = filename.replace('.json', '')
-        with open(path) as file:
-            schemas[file_raw] = json.load(file)
+    """Load schemas from schemas folder, once. The dict is shared, do not modify it"""
+    if not SCHEMAS:
+        schemas = {}
+        for stream_id in STREAMS:
+            with open(get_abs_path('schemas') + '/' + stream_id + '.json') as file:
+                schemas[stream_id] = json.load(file)
+        SCHEMAS.update(schemas)
 
-    return schemas
+    return SCHEMAS
 
 def load_metadata(schema,key_properties=None,replication_keys=None):
     """Load metadata"""
@@ -53,45 +67,13 @@ def discover():
     raw_schemas = load_schemas()
     streams = []
 
-    for schema_name, schema in raw_schemas.items():
-        stream_metadata = []
-
-        if schema_name=="attendees":
-            replication_keys = ['id']
-            key_properties = ['id']
-
-        if schema_name=="sales_reports":
-            replication_keys = ['event_id', 'date']
-            key_properties = ['event_id', 'date']
-
-        if schema_name=="events":
-            replication_keys = ['id']
-            key_properties = ['id']
-
-        if schema_name=="events":
-            replication_keys = ['id']
-            key_properties = ['id']
-
-        if schema_name=="orders":
-            replication_keys = ['id']
-            key_properties = ['id']
-
-        if schema_name=="categories":
-            replication_keys = ['id']
-            key_properties = ['id']
-
-        if schema_name=="subcategories":
-            replication_keys = ['id']
-            key_properties = ['id']   
-
-        stream_metadata = load_metadata(schema_name,key_properties,replication_keys)
-
+    for schema_name, keys in STREAMS.items():
         catalog_entry = {
             'stream': schema_name,
             'tap_stream_id': schema_name,
-            'schema': schema,
-            'metadata' : stream_metadata,
-            'key_properties': key_properties
+            'schema': raw_schemas[schema_name],
+            'metadata' : load_metadata(schema_name, keys['key_properties'], keys['replication_keys']),
+            'key_properties': keys['key_properties']
         }
 
         streams.append(catalog_entry)
@@ -113,283 +95,201 @@ def get_selected_streams(catalog):
 
     return selected_streams
 
-def sync_stitch_data(records, data_key, stream_schema, stream_id, loading_new_data = None, events_list=None, event_id=None):
-    """
-    Basiclly, this function will send the data into Stitch by this line of code:
-    singer.write_record(stream_id, record)
-    Keyword arguments:
-    stream_id -- table name
-    record -- a single data in JSON format
-
-    Then, the Stitch will replicate the data into Google Big Query (GBQ). 
-    We already have the configuration in Stitch that created a pipeline-
-    into GBQ and the method is append.
-    """
+
+def sync_stream(config, state, stream, loading_new_data):
+    """Sync one stream of the catalog, return the number of records sent into Stitch"""
+    stream_id = stream['tap_stream_id']
+    stream_schema = stream['schema']
+    # Metrics are kept per organization, the taxonomy belongs to none
+    org_id = None if stream_id in organizations.TAXONOMY_STREAMS else config['ORG_ID']
+    compiled_schema = start_stream(stream, org_id)
+
     count = 0
-    for record in records[data_key]:  
-
-        if stream_id == "events":
-            """
-            For the events table (stream_id == "events"), we need to collect the-
-            event ids into a list.
-            That will be served for the sale reports table. Sale reports will-
-            based on those event ids to retrieve the report for each event. 
-            """
-            events_list.append(record["id"])
-        
-        # parse_date: Correct the DateTime format
-        record = parse_date(stream_schema, record, loading_new_data)
-
-        if stream_id == "sales_reports":
-            """
-            For the sales reports table (stream_id == "sales_reports"),We need-
-            to add the event_id to the data before send it to Stitch, so we can know which event this-
-            report belongs to. 
-            """
-            record.update({"event_id": event_id})
-
-        # Check if record is not None => send the data into Stitch!
-        if record is not None:
-            singer.write_record(stream_id, record)
-            count += 1    
-
-    # Return number of records had been sent into Stitch
+    checkpoint_every = int(config.get('CHECKPOINT_EVERY_PAGES', DEFAULT_CHECKPOINT_EVERY_PAGES))
+    prefetch = int(config.get('PAGE_PREFETCH', DEFAULT_PREFETCH))
+
+    # Events table
+    if stream_id == "events":
+        # Not resumable: sales_reports needs every event id seen in this run
+        # The events API cannot filter on changed, so RUN_DAILY filters here
+        from tap_eventbrite.event import events_call, EXPANSIONS, DEFAULT_PAGE_SIZE
+
+        window_start = get_threshold_time_formatted() if loading_new_data else None
+        expand = get_expansions(stream_schema, EXPANSIONS)
+        sizer = get_page_sizer(config, stream_id, DEFAULT_PAGE_SIZE)
+        count = sync_paginated(
+            state, stream_id, 'events', stream_schema, compiled_schema,
+            sizer.measured(lambda continue_token: events_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token, expand, sizer.size), telemetry.get(stream_id, org_id)),
+            window_start=window_start, events=get_events(config['ORG_ID']), prefetch=prefetch, org_id=config['ORG_ID'])
+        skipped = telemetry.get(stream_id, org_id).records_skipped
+        if skipped:
+            LOGGER.info("events: skipped {} event(s) neither created nor changed since {}".format(skipped, window_start))
+
+    # Attendees table
+    elif stream_id == "attendees":
+        from tap_eventbrite.attendee import attendees_call, EXPANSIONS
+
+        changed_since = get_changed_since(state, stream_id, loading_new_data, config.get('BACKFILL_START'))
+        expand = get_expansions(stream_schema, EXPANSIONS)
+        sizer = get_page_sizer(config, stream_id)
+        if backfill.enabled(config, state, stream_id, loading_new_data):
+            count = backfill.sync_sharded(
+                config, state, stream_id, 'attendees', stream_schema, compiled_schema,
+                lambda continue_token, window_from: attendees_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token, window_from, expand, page_size=sizer.size),
+                changed_since, checkpoint_every, prefetch)
+        else:
+            count = sync_paginated(
+                state, stream_id, 'attendees', stream_schema, compiled_schema,
+                sizer.measured(lambda continue_token: attendees_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token, changed_since, expand, page_size=sizer.size), telemetry.get(stream_id, org_id)),
+                checkpoint_every, changed_since, track_changed=True, prefetch=prefetch, org_id=config['ORG_ID'])
+
+    # Sales Reports table 
+    elif stream_id == "sales_reports":
+        from tap_eventbrite.sales_report import sales_report_call
+
+        workers = min(int(config.get('SALES_REPORTS_CONCURRENCY', 1)), MAX_SALES_REPORTS_CONCURRENCY)
+        batch_size = int(config.get('SALES_REPORTS_BATCH_SIZE', 1))
+        writer = SalesReportWriter(state, stream_schema, compiled_schema, batch_size, loading_new_data, get_events(config['ORG_ID']), config['ORG_ID'])
+
+        def fetch_sales_report(event_ids):
+            return sales_report_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], event_ids, loading_new_data, writer.start_date(event_ids))
+
+        # Reports are fetched in parallel but come back in event order
+        reports = ordered_map(fetch_sales_report, writer.batches, workers)
+        for event_ids, records in zip(writer.batches, reports):
+            writer.write(event_ids, records)
+        count = writer.finish()
+
+    # Orders table
+    elif stream_id == "orders":
+        from tap_eventbrite.order import orders_call, EXPANSIONS
+
+        changed_since = get_changed_since(state, stream_id, loading_new_data, config.get('BACKFILL_START'))
+        expand = get_expansions(stream_schema, EXPANSIONS)
+        sizer = get_page_sizer(config, stream_id)
+        if backfill.enabled(config, state, stream_id, loading_new_data):
+            count = backfill.sync_sharded(
+                config, state, stream_id, 'orders', stream_schema, compiled_schema,
+                lambda continue_token, window_from: orders_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token, window_from, expand, page_size=sizer.size),
+                changed_since, checkpoint_every, prefetch)
+        else:
+            count = sync_paginated(
+                state, stream_id, 'orders', stream_schema, compiled_schema,
+                sizer.measured(lambda continue_token: orders_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token, changed_since, expand, page_size=sizer.size), telemetry.get(stream_id, org_id)),
+                checkpoint_every, changed_since, track_changed=True, prefetch=prefetch, org_id=config['ORG_ID'])
+
+    # Categories table  
+    elif stream_id == "categories":
+        if loading_new_data:
+            LOGGER.info("There is no data for categories!")
+        else:
+            from tap_eventbrite.category import categories_call
+            sizer = get_page_sizer(config, stream_id)
+            count = sync_paginated(
+                state, stream_id, 'categories', stream_schema, compiled_schema,
+                sizer.measured(lambda continue_token: categories_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token, sizer.size), telemetry.get(stream_id, org_id)),
+                checkpoint_every, prefetch=prefetch)
+
+    # Subcategories table  
+    elif stream_id == "subcategories":
+        if loading_new_data:
+            LOGGER.info("There is no data for subcategories!")
+        else:
+            from tap_eventbrite.subcategory import subcategories_call
+            sizer = get_page_sizer(config, stream_id)
+            count = sync_paginated(
+                state, stream_id, 'subcategories', stream_schema, compiled_schema,
+                sizer.measured(lambda continue_token: subcategories_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token, sizer.size), telemetry.get(stream_id, org_id)),
+                checkpoint_every, prefetch=prefetch)
+
+    else:
+        LOGGER.info("Not match!")
+
+    finish_stream(state, stream_id, count, org_id)
     return count
 
+
+def sync_stream_after(depends_on, config, state, stream, loading_new_data):
+    """Wait for the stream this one depends on, then sync it"""
+    if depends_on is not None:
+        depends_on.result()
+    return sync_stream(config, state, stream, loading_new_data)
+
 def sync(config, state, catalog):
-    """Sync data into GBQ"""
+    """
+    Sync data into GBQ.
+    Every organization syncs the selected streams, except the taxonomy which
+    is synced once, see tap_eventbrite.organizations.
+    With STREAM_CONCURRENCY above 1 they run on a thread pool. They are
+    independent of each other, except sales_reports, which waits for the
+    organization's events to fill its EventIndex.
+    With ENGINE "async" the streams run on one asyncio event loop instead, see
+    tap_eventbrite.aio.
+    """
     selected_stream_ids = get_selected_streams(catalog)
     loading_new_data = config['RUN_DAILY']
-    global EVENTS_LIST
-
-    # Loop over streams in catalog
-    for stream in catalog['streams']:
-        stream_id = stream['tap_stream_id']
-        stream_schema = stream['schema']
-        if stream_id in selected_stream_ids:
-            # Write schema table 
-            singer.write_schema(stream_id, stream_schema, stream['key_properties'])
-
-            has_more_items = True 
-            continue_token = ""
-            count = 0
-
-            # Events table
-            if stream_id == "events":
-                while has_more_items:
-                    records = events_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token)
-
-                    if len(records['events'])==0:
-                        LOGGER.info("{}: There is no data to stream".format(stream_id))
-                    else: 
-                        count += sync_stitch_data(records, 'events', stream_schema, stream_id, loading_new_data, EVENTS_LIST)
-                    
-                    """
-                    Check the data in the pagination response, if continuation- 
-                    is not None => Going to handle the next page.
-                    """
-                    if records['pagination'].get('continuation') is not None:
-                        continue_token =  records['pagination'].get('continuation')
-                        
-                    # if continuation is None => Finished 
-                    else:
-                        has_more_items = False
-
-            # Attendees table
-            elif stream_id == "attendees":
-                while has_more_items:
-                    changed_since = None
-
-                    if loading_new_data:
-                        changed_since = get_threshold_time_formatted()
-                    
-                    records = attendees_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token, changed_since)
-
-                    if len(records['attendees']) == 0:
-                        LOGGER.info("{}: There is no data to stream".format(stream_id))
-                    else: 
-                        count += sync_stitch_data(records, 'attendees', stream_schema, stream_id)   
-
-                    if records['pagination'].get('continuation') is not None:
-                        continue_token =  records['pagination'].get('continuation')
-                    else:
-                        has_more_items = False
-
-            # Sales Reports table 
-            elif stream_id == "sales_reports":
-                LOGGER.info("Making loop for sales_reports. Times: {}!".format(len(EVENTS_LIST)))
-                for event_id in EVENTS_LIST:
-                    records = sales_report_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], event_id, loading_new_data)
-
-                    if len(records['data']) == 0:
-                        LOGGER.info("{}: There is no data to stream".format(stream_id))
-                    else:
-                        count += sync_stitch_data(records, 'data', stream_schema, stream_id, event_id = event_id)
-
-            # Orders table
-            elif stream_id == "orders":
-                while has_more_items:
-                    changed_since = None
-
-                    if loading_new_data:
-                        changed_since = get_threshold_time_formatted()
-                    
-                    records = orders_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token, changed_since)
-                    
-                    if len(records['orders']) == 0:
-                        LOGGER.info("{}: There is no data to stream".format(stream_id))          
-                    else:
-                        count += sync_stitch_data(records, 'orders', stream_schema, stream_id)
-
-                    if records['pagination'].get('continuation') is not None:
-                        continue_token =  records['pagination'].get('continuation')
-                    else:
-                        has_more_items = False
-
-            # Categories table  
-            elif stream_id == "categories":
-                while has_more_items:
-                    if loading_new_data:
-                        LOGGER.info("There is no data for categories!")
-                        has_more_items = False
-
-                    else:
-                        records = categories_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token)
-                        
-                        if len(records['categories']) == 0:
-                            LOGGER.info("{}: There is no data to stream".format(stream_id))
-                        else:
-                            count += sync_stitch_data(records, 'categories', stream_schema, stream_id)
-
-                        if records['pagination'].get('continuation') is not None:
-                            continue_token =  records['pagination'].get('continuation')
-                        else:
-                            has_more_items = False
-
-            # Subcategories table  
-            elif stream_id == "subcategories":
-                while has_more_items:
-                    if loading_new_data:
-                        LOGGER.info("There is no data for subcategories!")
-                        has_more_items = False
-
-                    else:
-                        records = subcategories_call(config['EVENTBRITE_TOKEN'], config['ORG_ID'], continue_token)
-
-                        if len(records['subcategories']) == 0:
-                            LOGGER.info("{}: There is no data to stream".format(stream_id))
-                        else:
-                            count += sync_stitch_data(records, 'subcategories', stream_schema, stream_id)
-
-                        if records['pagination'].get('continuation') is not None:
-                            continue_token =  records['pagination'].get('continuation')
-                        else:
-                            has_more_items = False
-
-            else:
-                LOGGER.info("Not match!")
-
-            LOGGER.info('Syncing stream:' + stream_id)
-            LOGGER.info("\033[92mFor {}: loaded {} record(s) into Stitch!\033[0m".format(stream_id, count))
-    return
-
-def get_threshold_time():
-    now =  datetime.datetime.now() - datetime.timedelta(days=1)
-    return now
-
-def get_threshold_time_formatted():
-    now =  datetime.datetime.now() - datetime.timedelta(days=1)
-    formatted_date = "{}-{}-{}T00:00:00Z".format(now.year, now.month, now.day)
-    return formatted_date
-
-def parse_date(schema, record, loading_new_data = None):
-    """Correcting the data before sending it to Google Bigquery"""
-    result = {}
-    schema_properties = schema['properties']
-    schema_keys = []
-
-
-    if loading_new_data:
-        """
-        loading_new_data: Almost use for events table, cause the events API does not-
-        support to retrieve the new data. Basically, filtering out the new data.
-        """
-        created_time = datetime.datetime.strptime(record['created'],"%Y-%m-%dT%H:%M:%SZ")
-        changed_time = datetime.datetime.strptime(record['changed'],"%Y-%m-%dT%H:%M:%SZ")
-
-        now =  get_threshold_time()
-        changed_time_days = changed_time - now
-        created_time_days = created_time - now
-
-        if changed_time_days.days != 0 and created_time_days != 0:
-            return None
-
-    for schema_property in schema_properties:
-        schema_keys.append(schema_property)
-
-    for schema_key in schema_keys:
-        schema_key_properties = schema_properties[schema_key]
-        if "." in schema_key:
-            dict_nested_keys = schema_key.split(".")
-            temp_data = record[dict_nested_keys[0]]
-            dict_nested_keys.remove(dict_nested_keys[0])
-
-            for correct_schema in dict_nested_keys:
-                try:
-                    temp_data = temp_data[correct_schema]
-                    if schema_key_properties.get('format') is not None:
-                        if "Z" not in temp_data:
-                            temp_data = temp_data + "Z"
-
-                except:
-                    if schema_key_properties.get('format') is not None:
-                        temp_data = "1971-01-01T00:00:00Z"
-                    elif schema_key_properties['type'][1]  == "integer":
-                        temp_data = 0
-                    else:
-                        temp_data = ""
-
-            data = temp_data
-            
+    state = state or {}
+    workers = int(config.get('STREAM_CONCURRENCY', 1))
+    engine = config.get('ENGINE', "threads")
+    EVENTS.clear()
+
+    if engine == "async":
+        from tap_eventbrite import aio
+        if aio.aiohttp is None:
+            LOGGER.info("aiohttp is not installed, using the threads engine")
+            engine = "threads"
+
+    # One pooled keep-alive session per token for every API call
+    from tap_eventbrite import client
+    client.configure(config)
+    output.configure(config)
+    dedup.configure(config)
+    telemetry.reset()
+
+    try:
+        streams = [stream for stream in catalog['streams'] if stream.get('tap_stream_id') in selected_stream_ids]
+        jobs = organizations.plan(config, state, streams)
+
+        if engine == "async":
+            asyncio.run(aio.sync_streams(config, jobs, loading_new_data, workers))
+        elif workers <= 1:
+            for org_config, org_state, stream in jobs:
+                sync_stream(org_config, org_state, stream, loading_new_data)
         else:
-            try:
-                data = record[schema_key]
-                
-                if schema_key_properties.get('format') is not None:
-                    if "Z" not in data:
-                        data = data + "Z"
-
-            except:
-                if schema_key_properties.get('format') is not None:
-                    data = "1971-01-01T00:00:00Z"
-                elif schema_key_properties['type'][1]  == "integer":
-                    data = 0
-                else:
-                    data = ""
-
-        result.update({schema_key: data})
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                # Events first, so sales_reports never holds a worker while events waits for one
+                for org_config, org_state, stream in sorted(jobs, key=lambda job: job[2]['tap_stream_id'] != "events"):
+                    stream_id = stream['tap_stream_id']
+                    org_id = org_config['ORG_ID']
+                    depends_on = futures.get((org_id, "events")) if stream_id == "sales_reports" else None
+                    futures[(org_id, stream_id)] = executor.submit(sync_stream_after, depends_on, org_config, org_state, stream, loading_new_data)
+
+                for future in futures.values():
+                    future.result()
+    finally:
+        # Records still buffered by the fast output engine, files still open
+        output.close()
+        dedup.close()
+        # Also saves the calls of every token, so a failed run still counts against the quota
+        client.close()
+
+    if config.get('METRICS_FILE'):
+        telemetry.write_summary(config['METRICS_FILE'])
+    return
 
-    return result
 
 def sort_catalog(catalog):
     """Sorting catalog following the wish list"""
-    sorted_catalog = {'streams':[]}
-    wish_list = ["events" ,"sales_reports" ,"attendees", "orders", "categories", "subcategories"]
-    for element in wish_list:
-        sorted_catalog['streams'].append({})
-    
-    for element in catalog['streams']:
-        stream_id = element['stream']
-        new_index = wish_list.index(stream_id)
-        sorted_catalog['streams'][new_index] = element
-
-    return sorted_catalog
+    wish_list = list(STREAMS)
+    return {'streams': sorted(catalog['streams'], key=lambda element: wish_list.index(element['stream']))}
 
 @utils.handle_top_exception(LOGGER)
 def main():
 
     # Parse command line arguments
     args = utils.parse_args(REQUIRED_CONFIG_KEYS)
+    organizations.get_organizations(args.config)
 
     # If discover flag was passed, run discovery mode and dump output to stdout
     if args.discover:
@@ -403,7 +303,8 @@ def main():
             catalog =  discover()
 
         sorted_catalog = sort_catalog(catalog)
-        sync(args.config, args.state, sorted_catalog)
+        with telemetry.profile(args.config):
+            sync(args.config, args.state, sorted_catalog)
 
 if __name__ == "__main__":
     main()
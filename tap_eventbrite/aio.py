@@ -0,0 +1,358 @@
+"""
+Async engine, selected with ENGINE "async" in the tap config (pip install
+tap-eventbrite[async]).
+
+Every stream runs as a coroutine on one asyncio event loop and every API call
+goes through one aiohttp session, instead of a thread per stream, per
+prefetched page and per sales report. Pages are written by the same
+PageWriter and SalesReportWriter as the threads engine, so the Singer output
+and the state are the same.
+"""
+import asyncio
+import collections
+import functools
+import json
+import time
+import requests
+import singer
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from tap_eventbrite import backfill, client, organizations, streams, telemetry
+from tap_eventbrite.pagination import next_token, get_page_sizer, DEFAULT_PREFETCH
+from tap_eventbrite.ratelimit import backoff_delay, retry_after_delay
+from tap_eventbrite.event import events_url, EXPANSIONS as EVENT_EXPANSIONS, DEFAULT_PAGE_SIZE
+from tap_eventbrite.attendee import attendees_url, EXPANSIONS as ATTENDEE_EXPANSIONS
+from tap_eventbrite.sales_report import sales_report_url
+from tap_eventbrite.order import orders_url, EXPANSIONS as ORDER_EXPANSIONS
+from tap_eventbrite.category import categories_url
+from tap_eventbrite.subcategory import subcategories_url
+
+LOGGER = singer.get_logger()
+
+# A response of AsyncClient.send(), with the headers Retry-After is read from
+Reply = collections.namedtuple('Reply', ['status', 'headers', 'body'])
+
+class AsyncClient():
+    """
+    One aiohttp session for the whole run, with at most HTTP_POOL_SIZE
+    connections open. Calls are paced by the same per-token rate limiters as
+    client.get and retried the same way.
+
+    When a requests adapter is mounted with client.mount(), e.g. the offline
+    benchmarks' fake API, calls are sent through it instead, on at most
+    HTTP_POOL_SIZE threads.
+    """
+    def __init__(self):
+        self.adapter = client.TRANSPORT['adapter']
+        self.session = None
+        self.executor = None
+
+        if self.adapter is not None:
+            self.executor = ThreadPoolExecutor(max_workers=client.SETTINGS['pool_size'])
+        else:
+            connect_timeout, read_timeout = client.SETTINGS['timeout']
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=client.SETTINGS['pool_size']),
+                timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout))
+
+    async def send(self, url, headers):
+        """One GET request, return its Reply"""
+        if self.adapter is None:
+            async with self.session.get(url, headers=headers) as response:
+                return Reply(response.status, response.headers, await response.read())
+
+        request = requests.Request('GET', url, headers=headers).prepare()
+        response = await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(self.adapter.send, request, timeout=client.SETTINGS['timeout']))
+        return Reply(response.status_code, response.headers, response.content)
+
+    async def get(self, url, token, stream=None, org_id=None):
+        """GET an Eventbrite API url, return (status, body), counted for org_id"""
+        limiter = client.get_rate_limiter(token)
+        metrics = telemetry.get(stream, org_id)
+        headers = {'authorization': "Bearer {}".format(token)}
+
+        for attempt in range(client.SETTINGS['max_retries'] + 1):
+            metrics.add(throttle_seconds=await acquire(limiter))
+
+            started = time.monotonic()
+            try:
+                response = await self.send(url, headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError, requests.ConnectionError, requests.Timeout) as error:
+                response = None
+                reason = str(error) or type(error).__name__
+                metrics.add_request(time.monotonic() - started, 0)
+            else:
+                metrics.add_request(time.monotonic() - started, len(response.body))
+                if response.status != 429 and response.status < 500:
+                    return response.status, response.body
+                reason = "HTTP {}".format(response.status)
+
+            if attempt == client.SETTINGS['max_retries']:
+                break
+
+            delay = retry_after_delay(response) if response is not None else None
+            if delay is None:
+                delay = backoff_delay(attempt, client.SETTINGS['backoff_factor'], client.SETTINGS['backoff_max'])
+
+            LOGGER.info("{} for {}, retrying in {:.1f} second(s)".format(reason, url.split("?")[0], delay))
+            if response is not None and response.status == 429:
+                # The next acquire() waits, for every coroutine sharing this token
+                limiter.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+
+        raise client.EventbriteError("{} for {} after {} retries".format(reason, url.split("?")[0], client.SETTINGS['max_retries']))
+
+    async def get_json(self, url, token, stream, name, org_id=None):
+        """The JSON body of a 200 response, or None"""
+        status, body = await self.get(url, token, stream, org_id)
+        if status == 200:
+            return client.JsonPage(json.loads(body), len(body))
+
+        LOGGER.info("An error occerred when calling {} API!".format(name))
+        return None
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+async def acquire(limiter):
+    """RateLimiter.acquire() without blocking the event loop"""
+    waited = 0.0
+    while True:
+        wait = limiter.reserve()
+        if wait <= 0:
+            return waited
+
+        LOGGER.info("Rate limit reached, waiting {:.1f} second(s)".format(wait))
+        await asyncio.sleep(wait)
+        waited += wait
+
+async def events_call(http, token, org, continue_token, expand=None, page_size=DEFAULT_PAGE_SIZE):
+    return await http.get_json(events_url(org, continue_token, expand, page_size), token, "events", "Events", org)
+
+async def attendees_call(http, token, org, continue_token, changed_since, expand=None, page_size=None):
+    return await http.get_json(attendees_url(org, continue_token, changed_since, expand, page_size=page_size), token, "attendees", "Attendees", org)
+
+async def sales_report_call(http, token, org, event_ids, loading_new_data, start_date=None):
+    return await http.get_json(sales_report_url(org, event_ids, loading_new_data, start_date), token, "sales_reports", "Sales Report", org)
+
+async def orders_call(http, token, org, continue_token, changed_since=None, expand=None, page_size=None):
+    return await http.get_json(orders_url(org, continue_token, changed_since, expand, page_size=page_size), token, "orders", "Orders", org)
+
+async def categories_call(http, token, org, continue_token, page_size=None):
+    return await http.get_json(categories_url(org, continue_token, page_size), token, "categories", "Categories")
+
+async def subcategories_call(http, token, org, continue_token, page_size=None):
+    return await http.get_json(subcategories_url(org, continue_token, page_size), token, "subcategories", "Subcategories")
+
+def measured(sizer, fetch, metrics):
+    """PageSizer.measured() for a coroutine fetch"""
+    if not sizer.adaptive:
+        return fetch
+
+    async def fetch_page(continue_token):
+        throttled = metrics.throttle_seconds
+        started = time.monotonic()
+        page = await fetch(continue_token)
+        seconds = time.monotonic() - started - (metrics.throttle_seconds - throttled)
+        if page is not None:
+            sizer.observe(seconds, page.size)
+        return page
+
+    return fetch_page
+
+async def sync_paginated(writer, fetch, prefetch=DEFAULT_PREFETCH):
+    """
+    Follow the continuation tokens of a paginated endpoint, writing every page
+    with writer, a PageWriter. With prefetch above 0 the next page is
+    requested before this one is written.
+    """
+    continue_token = writer.start()
+    next_page = None
+
+    try:
+        while continue_token is not None:
+            page = await (next_page or fetch(continue_token))
+            next_page = None
+
+            if writer.refused(page):
+                continue_token = ""
+                continue
+
+            if prefetch > 0 and next_token(page) is not None:
+                next_page = asyncio.ensure_future(fetch(next_token(page)))
+            continue_token = writer.write(page)
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+    return writer.finish()
+
+async def sync_sharded(config, state, stream_id, data_key, stream_schema, compiled_schema, call, changed_since, checkpoint_every=0, prefetch=DEFAULT_PREFETCH):
+    """
+    backfill.sync_sharded with a coroutine per shard. call(continue_token,
+    changed_since) is a coroutine returning one page of the organization endpoint.
+    """
+    bookmark, indexes = backfill.start(config, state, stream_id, changed_since)
+
+    def sync_shard(writer):
+        window_from = writer.shard['from']
+        return sync_paginated(writer, lambda continue_token: call(continue_token, window_from), prefetch)
+
+    writers = backfill.writers(config, state, stream_id, data_key, stream_schema, compiled_schema, bookmark, indexes, checkpoint_every)
+    counts = await asyncio.gather(*(sync_shard(writer) for writer in writers))
+
+    backfill.finish(state, stream_id, bookmark, indexes)
+    return sum(counts)
+
+async def ordered_gather(func, items, workers):
+    """
+    Async generator of await func(item) for every item, in the same order as
+    items, with up to `workers` calls running at the same time. Like
+    concurrency.ordered_map, only a small window of results is held.
+    """
+    semaphore = asyncio.Semaphore(max(workers, 1))
+
+    async def call(item):
+        async with semaphore:
+            return await func(item)
+
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(asyncio.ensure_future(call(item)))
+
+            if len(pending) >= max(workers, 1) * 2:
+                yield await pending.popleft()
+
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def sync_stream(http, config, state, stream, loading_new_data):
+    """tap_eventbrite.sync_stream on the event loop"""
+    stream_id = stream['tap_stream_id']
+    stream_schema = stream['schema']
+    token = config['EVENTBRITE_TOKEN']
+    org = config['ORG_ID']
+    org_id = None if stream_id in organizations.TAXONOMY_STREAMS else org
+    compiled_schema = streams.start_stream(stream, org_id)
+    count = 0
+    checkpoint_every = int(config.get('CHECKPOINT_EVERY_PAGES', streams.DEFAULT_CHECKPOINT_EVERY_PAGES))
+    prefetch = int(config.get('PAGE_PREFETCH', DEFAULT_PREFETCH))
+
+    if stream_id == "events":
+        window_start = streams.get_threshold_time_formatted() if loading_new_data else None
+        expand = streams.get_expansions(stream_schema, EVENT_EXPANSIONS)
+        writer = streams.PageWriter(state, stream_id, 'events', stream_schema, compiled_schema, window_start=window_start, events=streams.get_events(org), org_id=org)
+        sizer = get_page_sizer(config, stream_id, DEFAULT_PAGE_SIZE)
+        fetch = lambda continue_token: events_call(http, token, org, continue_token, expand, sizer.size)
+        count = await sync_paginated(writer, measured(sizer, fetch, telemetry.get(stream_id, org_id)), prefetch)
+        skipped = telemetry.get(stream_id, org_id).records_skipped
+        if skipped:
+            LOGGER.info("events: skipped {} event(s) neither created nor changed since {}".format(skipped, window_start))
+
+    elif stream_id == "attendees":
+        changed_since = streams.get_changed_since(state, stream_id, loading_new_data, config.get('BACKFILL_START'))
+        expand = streams.get_expansions(stream_schema, ATTENDEE_EXPANSIONS)
+        sizer = get_page_sizer(config, stream_id)
+        if backfill.enabled(config, state, stream_id, loading_new_data):
+            count = await sync_sharded(
+                config, state, stream_id, 'attendees', stream_schema, compiled_schema,
+                lambda continue_token, window_from: attendees_call(http, token, org, continue_token, window_from, expand, sizer.size),
+                changed_since, checkpoint_every, prefetch)
+        else:
+            writer = streams.PageWriter(state, stream_id, 'attendees', stream_schema, compiled_schema, checkpoint_every, changed_since, track_changed=True, org_id=org)
+            fetch = lambda continue_token: attendees_call(http, token, org, continue_token, changed_since, expand, sizer.size)
+            count = await sync_paginated(writer, measured(sizer, fetch, telemetry.get(stream_id, org_id)), prefetch)
+
+    elif stream_id == "sales_reports":
+        # No thread per report here, so the thread engine's cap does not apply
+        workers = int(config.get('SALES_REPORTS_CONCURRENCY', 1))
+        batch_size = int(config.get('SALES_REPORTS_BATCH_SIZE', 1))
+        writer = streams.SalesReportWriter(state, stream_schema, compiled_schema, batch_size, loading_new_data, streams.get_events(org), org)
+
+        def fetch_sales_report(event_ids):
+            return sales_report_call(http, token, org, event_ids, loading_new_data, writer.start_date(event_ids))
+
+        batches = iter(writer.batches)
+        async for records in ordered_gather(fetch_sales_report, writer.batches, workers):
+            writer.write(next(batches), records)
+        count = writer.finish()
+
+    elif stream_id == "orders":
+        changed_since = streams.get_changed_since(state, stream_id, loading_new_data, config.get('BACKFILL_START'))
+        expand = streams.get_expansions(stream_schema, ORDER_EXPANSIONS)
+        sizer = get_page_sizer(config, stream_id)
+        if backfill.enabled(config, state, stream_id, loading_new_data):
+            count = await sync_sharded(
+                config, state, stream_id, 'orders', stream_schema, compiled_schema,
+                lambda continue_token, window_from: orders_call(http, token, org, continue_token, window_from, expand, sizer.size),
+                changed_since, checkpoint_every, prefetch)
+        else:
+            writer = streams.PageWriter(state, stream_id, 'orders', stream_schema, compiled_schema, checkpoint_every, changed_since, track_changed=True, org_id=org)
+            fetch = lambda continue_token: orders_call(http, token, org, continue_token, changed_since, expand, sizer.size)
+            count = await sync_paginated(writer, measured(sizer, fetch, telemetry.get(stream_id, org_id)), prefetch)
+
+    elif stream_id in ("categories", "subcategories"):
+        if loading_new_data:
+            LOGGER.info("There is no data for {}!".format(stream_id))
+        else:
+            call = categories_call if stream_id == "categories" else subcategories_call
+            writer = streams.PageWriter(state, stream_id, stream_id, stream_schema, compiled_schema, checkpoint_every)
+            sizer = get_page_sizer(config, stream_id)
+            fetch = lambda continue_token: call(http, token, org, continue_token, sizer.size)
+            count = await sync_paginated(writer, measured(sizer, fetch, telemetry.get(stream_id, org_id)), prefetch)
+
+    else:
+        LOGGER.info("Not match!")
+
+    streams.finish_stream(state, stream_id, count, org_id)
+    return count
+
+async def sync_streams(config, jobs, loading_new_data, workers=1):
+    """
+    Sync the (config, state, stream) jobs of tap_eventbrite.organizations.plan
+    one after the other, or with workers above 1 up to `workers` at the same
+    time. sales_reports waits for the organization's events either way.
+    """
+    if config.get('HTTP_CACHE_DIR'):
+        LOGGER.info("The async engine does not use the response cache")
+
+    http = AsyncClient()
+    try:
+        if workers <= 1:
+            for org_config, org_state, stream in jobs:
+                await sync_stream(http, org_config, org_state, stream, loading_new_data)
+            return
+
+        semaphore = asyncio.Semaphore(workers)
+
+        async def run(org_config, org_state, stream, depends_on):
+            if depends_on is not None:
+                await depends_on
+            async with semaphore:
+                return await sync_stream(http, org_config, org_state, stream, loading_new_data)
+
+        tasks = {}
+        for org_config, org_state, stream in sorted(jobs, key=lambda job: job[2]['tap_stream_id'] != "events"):
+            stream_id = stream['tap_stream_id']
+            org_id = org_config['ORG_ID']
+            depends_on = tasks.get((org_id, "events")) if stream_id == "sales_reports" else None
+            tasks[(org_id, stream_id)] = asyncio.ensure_future(run(org_config, org_state, stream, depends_on))
+
+        await asyncio.gather(*tasks.values())
+    finally:
+        await http.close()
@@ -1,12 +1,17 @@
-import requests
 import time
 import os
 import singer
 import json  
 
+from tap_eventbrite import client
+
 LOGGER = singer.get_logger() 
 
-def attendees_call(token, org, continue_token, changed_since):
+# Expansions the attendees endpoint accepts, used when the schema has fields under them
+EXPANSIONS = ["event", "order", "category", "promotional_code", "assigned_unit", "answers",
+              "survey", "survey_responses"]
+
+def attendees_url(org, continue_token, changed_since, expand=None, page_size=None):
     if changed_since is not None:
         date = changed_since
     else:
@@ -16,15 +21,21 @@ def attendees_call(token, org, continue_token, changed_since):
 
     if len(continue_token) > 0:
         url = url + "&continuation={}".format(continue_token)
-    
-    headers = {
-        'authorization': "Bearer {}".format(token)
-    }
 
-    response = requests.request("GET", url, headers=headers)
+    if expand:
+        url = url + "&expand={}".format(",".join(expand))
+
+    if page_size:
+        url = url + "&page_size={}".format(page_size)
+
+    return url
+
+def attendees_call(token, org, continue_token, changed_since, expand=None, page_size=None):
+    url = attendees_url(org, continue_token, changed_since, expand, page_size)
+    response = client.get(url, token, "attendees", org)
 
     if response.status_code == 200:
-        attendees_json = response.json()
+        attendees_json = client.page(response, "attendees", "attendees", org)
         return attendees_json
 
     else:
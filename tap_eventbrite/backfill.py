@@ -0,0 +1,221 @@
+"""
+Sharded backfills of attendees and orders.
+
+A sharded backfill splits the history of a first full load, from its
+changed_since (BACKFILL_START) to the time the backfill started, into
+BACKFILL_SHARDS windows of equal length. Every window is its own continuation
+chain over the organization endpoint, from changed_since=<window start>, and
+the shards run on their own threads (or coroutines with the async engine).
+
+The organization endpoints only take a lower bound, and list the records
+oldest change first. A shard keeps the records changed inside its window and
+stops at the first page whose records all changed after it, so it reads its
+own window plus at most that one page (and one more prefetched page). A
+backfill costs about the requests of the linear chain plus two per shard, but
+they are spread over the shards. The last window ends when the backfill
+started, or at BACKFILL_END. A shard that reads a record changed before the
+one it read last stops the sync, since it could have stopped before records
+of its window.
+
+Every shard keeps its own continuation token in the state, so an interrupted
+backfill resumes each shard where it stopped. A record is in one window only:
+once changed while the backfill runs, it is past every window. Once every
+shard is done, the stream is bookmarked at the time the backfill started and
+the next runs are incremental again: they pick up what changed during the
+backfill.
+
+With BACKFILL_SHARD set, only that shard runs, so the shards can also be
+separate processes, each with its own state. They must share BACKFILL_END
+so they plan the same windows.
+"""
+import datetime
+import singer
+
+from concurrent.futures import ThreadPoolExecutor
+
+from tap_eventbrite import output, streams, telemetry
+from tap_eventbrite.pagination import next_token
+
+LOGGER = singer.get_logger()
+
+# Where the organization endpoints start without changed_since
+DEFAULT_BACKFILL_START = "2020-01-01T00:00:00Z"
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+def enabled(config, state, stream_id, loading_new_data):
+    """True when this run of the stream is (or continues) a sharded backfill"""
+    if singer.get_bookmark(state, stream_id, 'backfill'):
+        return True
+
+    if int(config.get('BACKFILL_SHARDS', 1)) <= 1 or loading_new_data:
+        return False
+
+    # Only a first full load, and never on top of a linear page checkpoint
+    return (singer.get_bookmark(state, stream_id, 'changed') is None
+            and not singer.get_bookmark(state, stream_id, 'continuation'))
+
+def plan_shards(start, end, count):
+    """
+    Split [start, end) into up to `count` windows of the same length, at least
+    one second each. A shard is {'from': ..., 'to': ..., 'continuation': "",
+    'done': False}, with UTC ISO 8601 bounds.
+    """
+    start_time = datetime.datetime.strptime(start[:19] + "Z", DATE_FORMAT)
+    end_time = datetime.datetime.strptime(end[:19] + "Z", DATE_FORMAT)
+    seconds = int((end_time - start_time).total_seconds())
+    count = max(1, min(count, seconds))
+
+    bounds = [start_time + datetime.timedelta(seconds=seconds * index // count) for index in range(count)]
+    bounds.append(end_time)
+    return [{'from': bounds[index].strftime(DATE_FORMAT), 'to': bounds[index + 1].strftime(DATE_FORMAT),
+             'continuation': "", 'done': False}
+            for index in range(count)]
+
+def start(config, state, stream_id, changed_since):
+    """
+    The backfill bookmark of the stream, planned on the first run, and the
+    indexes of the shards this process runs
+    """
+    backfill = singer.get_bookmark(state, stream_id, 'backfill')
+    if backfill is None:
+        started_at = config.get('BACKFILL_END') or datetime.datetime.now(datetime.timezone.utc).strftime(DATE_FORMAT)
+        backfill = {
+            'started_at': started_at,
+            'shards': plan_shards(changed_since or DEFAULT_BACKFILL_START, started_at, int(config['BACKFILL_SHARDS'])),
+        }
+        output.write_bookmark(state, stream_id, 'backfill', backfill)
+    else:
+        LOGGER.info("{}: resuming the sharded backfill started at {}".format(stream_id, backfill['started_at']))
+
+    indexes = list(range(len(backfill['shards'])))
+    if config.get('BACKFILL_SHARD') is not None:
+        indexes = [index for index in indexes if index == int(config['BACKFILL_SHARD'])]
+
+    LOGGER.info("{}: backfilling {} shard(s) of {}, {} left".format(
+        stream_id, len(indexes), len(backfill['shards']), sum(1 for index in indexes if not backfill['shards'][index]['done'])))
+    return backfill, indexes
+
+def finish(state, stream_id, backfill, indexes):
+    """Bookmark the stream at the end of the backfill once the shards of this process are done"""
+    if all(backfill['shards'][index]['done'] for index in indexes):
+        # Changes made while the backfill ran are picked up by the next incremental run
+        output.clear_bookmark(state, stream_id, 'backfill')
+        output.write_bookmark(state, stream_id, 'changed', backfill['started_at'])
+
+class ShardWriter():
+    """
+    Writes the pages of one shard into Stitch and keeps its continuation in
+    the backfill bookmark. It has the start / refused / write / finish methods
+    of streams.PageWriter, so both engines drive it the same way;
+    write() returns None once the shard is past its window.
+
+    Records without a changed date go to the first shard.
+    """
+    def __init__(self, state, stream_id, data_key, stream_schema, compiled_schema, shard, first=False, checkpoint_every=0, org_id=None):
+        self.state = state
+        self.stream_id = stream_id
+        self.data_key = data_key
+        self.stream_schema = stream_schema
+        self.compiled_schema = compiled_schema
+        self.shard = shard
+        self.first = first
+        self.checkpoint_every = checkpoint_every
+        self.org_id = org_id
+        self.count = 0
+        self.pages = 0
+        self.last_changed = None
+
+    def start(self):
+        """The continuation token of the first page to fetch, None when the shard is done"""
+        if self.shard['done']:
+            return None
+        return self.shard['continuation']
+
+    def refused(self, records):
+        """True when the API refused the saved continuation, the shard then starts from the first page"""
+        if records is None and self.pages == 0 and self.shard['continuation']:
+            LOGGER.info("{}: the saved continuation of the shard from {} was refused, starting it over".format(self.stream_id, self.shard['from']))
+            with output.LOCK:
+                self.shard['continuation'] = ""
+            return True
+        return False
+
+    def write(self, records):
+        """Send the page's records of this window into Stitch, return the continuation token of the next page or None"""
+        streams.check_response(records, self.stream_id)
+        self.pages += 1
+        telemetry.get(self.stream_id, self.org_id).add(pages=1)
+
+        window_from = self.shard['from'][:19]
+        window_to = self.shard['to'][:19]
+        past = {'records': 0, 'after': 0}
+
+        def in_window(page):
+            for record in page:
+                past['records'] += 1
+                changed = record.get('changed')
+                if type(changed) is str:
+                    if self.last_changed is not None and changed[:19] < self.last_changed:
+                        from tap_eventbrite.client import EventbriteError
+                        raise EventbriteError(
+                            "{}: a record changed at {} came after one changed at {}, the API does not list records oldest "
+                            "change first and a shard could miss some, set BACKFILL_SHARDS to 1".format(self.stream_id, changed, self.last_changed))
+                    self.last_changed = changed[:19]
+
+                    if changed[:19] >= window_to:
+                        past['after'] += 1
+                        continue
+                    if changed[:19] < window_from:
+                        continue
+                elif not self.first:
+                    continue
+                yield record
+
+        self.count += streams.sync_stitch_data(
+            {self.data_key: in_window(records[self.data_key])}, self.data_key, self.stream_schema, self.stream_id,
+            compiled_schema=self.compiled_schema, org_id=self.org_id, batch_size=streams.record_batch_size(records))
+
+        continue_token = next_token(records)
+        if past['records'] > 0 and past['after'] == past['records']:
+            # Every record of this page changed after the window, so do the next pages
+            continue_token = None
+
+        with output.LOCK:
+            self.shard['continuation'] = continue_token or ""
+            self.shard['done'] = continue_token is None
+            if self.shard['done'] or (self.checkpoint_every and self.pages % self.checkpoint_every == 0):
+                output.write_state(self.state)
+
+        return continue_token
+
+    def finish(self):
+        return self.count
+
+def writers(config, state, stream_id, data_key, stream_schema, compiled_schema, backfill, indexes, checkpoint_every=0):
+    """A ShardWriter for each shard this process runs"""
+    return [ShardWriter(state, stream_id, data_key, stream_schema, compiled_schema, backfill['shards'][index],
+                        index == 0, checkpoint_every, config['ORG_ID'])
+            for index in indexes]
+
+def sync_sharded(config, state, stream_id, data_key, stream_schema, compiled_schema, call, changed_since, checkpoint_every=0, prefetch=1):
+    """
+    Backfill one stream shard by shard on threads, return the number of
+    records sent into Stitch. call(continue_token, changed_since) returns one
+    page of the organization endpoint.
+    """
+    backfill, indexes = start(config, state, stream_id, changed_since)
+
+    def sync_shard(writer):
+        window_from = writer.shard['from']
+        return streams.write_pages(writer, lambda continue_token: call(continue_token, window_from), prefetch)
+
+    shard_writers = writers(config, state, stream_id, data_key, stream_schema, compiled_schema, backfill, indexes, checkpoint_every)
+    if len(shard_writers) <= 1:
+        count = sum(sync_shard(writer) for writer in shard_writers)
+    else:
+        with ThreadPoolExecutor(max_workers=len(shard_writers)) as executor:
+            count = sum(executor.map(sync_shard, shard_writers))
+
+    finish(state, stream_id, backfill, indexes)
+    return count
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import singer
+
+LOGGER = singer.get_logger()
+
+DEFAULT_MAX_MB = 256
+
+# Seconds a cached page is used without asking the API. 0 always revalidates
+# with ETag / Last-Modified. Streams that are not listed are never cached.
+DEFAULT_TTLS = {
+    'categories': 7 * 86400,
+    'subcategories': 7 * 86400,
+    'events': 0,
+}
+
+class ResponseCache():
+    """
+    On-disk cache of API responses, one JSON file per url and token.
+
+    Files are written to a temporary name and renamed into place, so several
+    runs on the same host can share the directory: a reader sees either the
+    old or the new entry, never half of one. Hits bump the file's mtime and
+    the least recently used files are deleted once the directory grows past
+    max_bytes. A file deleted by another run in the meantime is just skipped.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for path, mtime, size in self.entries())
+
+    def path(self, url, token):
+        key = hashlib.sha256("{}\n{}".format(token, url).encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, url, token):
+        """The cached entry, or None"""
+        path = self.path(url, token)
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('url') == url else None
+
+    def put(self, url, token, body, etag=None, last_modified=None):
+        entry = {
+            'url': url,
+            'stored_at': time.time(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'body': body,
+        }
+        path = self.path(url, token)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(handle, 'w') as file:
+                json.dump(entry, file)
+            os.replace(temporary, path)
+        except OSError:
+            LOGGER.info("Could not write the response cache entry for {}".format(url.split("?")[0]))
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return entry
+
+        with self.lock:
+            self.size += os.path.getsize(path)
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+        return entry
+
+    def refresh(self, url, token, entry):
+        """Keep an entry the API confirmed as unchanged for another TTL"""
+        return self.put(url, token, entry['body'], entry.get('etag'), entry.get('last_modified'))
+
+    def entries(self):
+        """(path, mtime, size) of every cache file"""
+        for root, directories, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def evict(self):
+        """Delete the least recently used files until the cache is at 90% of max_bytes"""
+        with self.lock:
+            entries = sorted(self.entries(), key=lambda entry: entry[1])
+            size = sum(entry[2] for entry in entries)
+            target = self.max_bytes * 0.9
+
+            for path, mtime, file_size in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                size -= file_size
+
+            self.size = size
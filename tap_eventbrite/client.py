@@ -0,0 +1,261 @@
+import os
+import threading
+import time
+import requests
+import singer
+
+from requests.adapters import HTTPAdapter
+from tap_eventbrite import telemetry
+from tap_eventbrite.cache import ResponseCache, DEFAULT_MAX_MB, DEFAULT_TTLS
+from tap_eventbrite.streaming import StreamedPage, CHUNK_SIZE
+from tap_eventbrite.ratelimit import RateLimiter, backoff_delay, calls_path, retry_after_delay, DEFAULT_CALLS_PER_HOUR, DEFAULT_CALLS_PER_DAY
+
+LOGGER = singer.get_logger()
+
+BASE_URL = "https://www.eventbriteapi.com/v3"
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 300
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 1
+DEFAULT_BACKOFF_MAX = 60
+
+SETTINGS = {
+    'pool_size': DEFAULT_POOL_SIZE,
+    'timeout': (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    'max_retries': DEFAULT_MAX_RETRIES,
+    'backoff_factor': DEFAULT_BACKOFF_FACTOR,
+    'backoff_max': DEFAULT_BACKOFF_MAX,
+    'calls_per_hour': DEFAULT_CALLS_PER_HOUR,
+    'calls_per_day': DEFAULT_CALLS_PER_DAY,
+    'rate_limit_dir': None,
+    'stream_json': False,
+}
+
+SESSIONS = {} # One keep-alive session per token
+LIMITERS = {} # One rate limiter per token
+TRANSPORT = {'adapter': None} # Replaces the HTTPS adapter, e.g. the offline benchmarks' fake API
+POOL = {'adapter': None} # The keep-alive connections to eventbriteapi.com, shared by the session of every token
+CACHE = {'cache': None, 'ttls': DEFAULT_TTLS} # On-disk response cache, off unless HTTP_CACHE_DIR is set
+SESSIONS_LOCK = threading.Lock()
+
+class EventbriteError(Exception):
+    """Raised when the Eventbrite API keeps failing after every retry"""
+
+def configure(config):
+    """
+    Read the optional HTTP settings from the tap config:
+    HTTP_POOL_SIZE -- connections kept alive to eventbriteapi.com (default 10)
+    HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT -- seconds (default 10 / 300)
+    HTTP_MAX_RETRIES -- retries for 429, 5xx and connection errors (default 5)
+    HTTP_BACKOFF_FACTOR / HTTP_BACKOFF_MAX -- backoff base and cap in seconds (default 1 / 60)
+    RATE_LIMIT_PER_HOUR / RATE_LIMIT_PER_DAY -- calls allowed per token (default 2000 / 48000)
+    RATE_LIMIT_DIR -- directory where the call times of every token are kept between runs
+        (default <HTTP_CACHE_DIR>/rate_limits, off without HTTP_CACHE_DIR)
+    HTTP_CACHE_DIR -- directory of the on-disk response cache (default off)
+    HTTP_CACHE_MAX_MB -- size the cache is trimmed to (default 256)
+    HTTP_CACHE_TTL -- seconds a cached page is used per stream, 0 always revalidates
+    STREAM_JSON -- parse the records of a page while it is downloaded (default False)
+    """
+    SETTINGS['pool_size'] = int(config.get('HTTP_POOL_SIZE', DEFAULT_POOL_SIZE))
+    SETTINGS['timeout'] = (
+        float(config.get('HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)),
+        float(config.get('HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT)),
+    )
+    SETTINGS['max_retries'] = int(config.get('HTTP_MAX_RETRIES', DEFAULT_MAX_RETRIES))
+    SETTINGS['backoff_factor'] = float(config.get('HTTP_BACKOFF_FACTOR', DEFAULT_BACKOFF_FACTOR))
+    SETTINGS['backoff_max'] = float(config.get('HTTP_BACKOFF_MAX', DEFAULT_BACKOFF_MAX))
+    SETTINGS['calls_per_hour'] = int(config.get('RATE_LIMIT_PER_HOUR', DEFAULT_CALLS_PER_HOUR))
+    SETTINGS['calls_per_day'] = int(config.get('RATE_LIMIT_PER_DAY', DEFAULT_CALLS_PER_DAY))
+    SETTINGS['stream_json'] = bool(config.get('STREAM_JSON', False))
+    close()
+
+    SETTINGS['rate_limit_dir'] = config.get('RATE_LIMIT_DIR')
+    if SETTINGS['rate_limit_dir'] is None and config.get('HTTP_CACHE_DIR'):
+        SETTINGS['rate_limit_dir'] = os.path.join(config['HTTP_CACHE_DIR'], "rate_limits")
+
+    with SESSIONS_LOCK:
+        LIMITERS.clear()
+
+    CACHE['ttls'] = dict(DEFAULT_TTLS, **config.get('HTTP_CACHE_TTL', {}))
+    if config.get('HTTP_CACHE_DIR'):
+        max_mb = float(config.get('HTTP_CACHE_MAX_MB', DEFAULT_MAX_MB))
+        CACHE['cache'] = ResponseCache(config['HTTP_CACHE_DIR'], int(max_mb * 1024 * 1024))
+    else:
+        CACHE['cache'] = None
+
+def get_session(token):
+    """Return the pooled session for this token, creating it on first use"""
+    with SESSIONS_LOCK:
+        session = SESSIONS.get(token)
+
+        if session is None:
+            session = requests.Session()
+            adapter = TRANSPORT['adapter']
+            if adapter is None:
+                if POOL['adapter'] is None:
+                    POOL['adapter'] = HTTPAdapter(pool_connections=1, pool_maxsize=SETTINGS['pool_size'])
+                adapter = POOL['adapter']
+            session.mount("https://", adapter)
+            session.headers.update({
+                'authorization': "Bearer {}".format(token)
+            })
+            SESSIONS[token] = session
+
+        return session
+
+def get_rate_limiter(token):
+    """Return the rate limiter for this token, creating it on first use"""
+    with SESSIONS_LOCK:
+        limiter = LIMITERS.get(token)
+
+        if limiter is None:
+            path = calls_path(SETTINGS['rate_limit_dir'], token) if SETTINGS['rate_limit_dir'] else None
+            limiter = RateLimiter(SETTINGS['calls_per_hour'], SETTINGS['calls_per_day'], path)
+            LIMITERS[token] = limiter
+
+        return limiter
+
+def get(url, token, stream=None, org_id=None):
+    """
+    GET an Eventbrite API url through the pooled session, counting the request
+    in the stream's metrics.
+    When the response cache is on and the stream has a TTL, a cached page
+    younger than the TTL is returned without a request. An older one is
+    revalidated with If-None-Match / If-Modified-Since and reused on a 304.
+    Otherwise, with STREAM_JSON, the body is left to be read by page().
+    org_id is the organization the request is counted for.
+    """
+    cache = CACHE['cache']
+    ttl = CACHE['ttls'].get(stream)
+    if cache is None or ttl is None:
+        return fetch(url, token, stream, streamed=SETTINGS['stream_json'], org_id=org_id)
+
+    entry = cache.get(url, token)
+    if entry is not None and time.time() - entry['stored_at'] < ttl:
+        telemetry.get(stream, org_id).add(cache_hits=1)
+        return cached_response(url, entry)
+
+    headers = {}
+    if entry is not None and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry is not None and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    response = fetch(url, token, stream, headers, org_id=org_id)
+
+    if response.status_code == 304 and entry is not None:
+        telemetry.get(stream, org_id).add(cache_hits=1)
+        return cached_response(url, cache.refresh(url, token, entry))
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if response.status_code == 200 and (ttl > 0 or etag or last_modified):
+        cache.put(url, token, response.content.decode('utf-8'), etag, last_modified)
+    return response
+
+def fetch(url, token, stream=None, headers=None, streamed=False, org_id=None):
+    """
+    Calls are paced by the token's rate limiter. 429, 5xx and connection
+    errors are retried with jittered exponential backoff, honouring
+    Retry-After. Any other response is returned to the caller.
+    With streamed, the response is returned before its body is downloaded,
+    and a connection error while it is read is not retried.
+    """
+    session = get_session(token)
+    limiter = get_rate_limiter(token)
+    metrics = telemetry.get(stream, org_id)
+
+    for attempt in range(SETTINGS['max_retries'] + 1):
+        metrics.add(throttle_seconds=limiter.acquire())
+
+        started = time.monotonic()
+        try:
+            response = session.get(url, timeout=SETTINGS['timeout'], headers=headers, stream=streamed)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            response = None
+            reason = str(error)
+            metrics.add_request(time.monotonic() - started, 0)
+        else:
+            if response.status_code != 429 and response.status_code < 500 and streamed:
+                # The bytes are counted as page() reads them
+                metrics.add_request(time.monotonic() - started, 0)
+                return response
+
+            metrics.add_request(time.monotonic() - started, len(response.content))
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            reason = "HTTP {}".format(response.status_code)
+
+        if attempt == SETTINGS['max_retries']:
+            break
+
+        delay = retry_after_delay(response) if response is not None else None
+        if delay is None:
+            delay = backoff_delay(attempt, SETTINGS['backoff_factor'], SETTINGS['backoff_max'])
+
+        LOGGER.info("{} for {}, retrying in {:.1f} second(s)".format(reason, url.split("?")[0], delay))
+        if response is not None and response.status_code == 429:
+            # The next acquire() waits, for every thread sharing this token
+            limiter.pause(delay)
+        else:
+            time.sleep(delay)
+
+    raise EventbriteError("{} for {} after {} retries".format(reason, url.split("?")[0], SETTINGS['max_retries']))
+
+class JsonPage(dict):
+    """A page loaded in memory, with the size of its body in bytes"""
+    def __init__(self, page, size):
+        super().__init__(page)
+        self.size = size
+
+    def when_read(self, callback):
+        """StreamedPage.when_read(): the body of this page is already read"""
+        callback()
+
+def page(response, data_key, stream=None, org_id=None):
+    """
+    The JSON page of a 200 response. With STREAM_JSON, a StreamedPage whose
+    records are parsed while the body is downloaded, otherwise a JsonPage.
+    """
+    if not SETTINGS['stream_json']:
+        return JsonPage(response.json(), len(response.content))
+
+    if response.raw is None or response._content_consumed:
+        # Already in memory, e.g. a cached page
+        return StreamedPage([response.content], data_key)
+
+    metrics = telemetry.get(stream, org_id)
+
+    def chunks():
+        for chunk in response.iter_content(CHUNK_SIZE):
+            metrics.add(bytes_downloaded=len(chunk))
+            yield chunk
+
+    return StreamedPage(chunks(), data_key, response.close)
+
+def cached_response(url, entry):
+    """A 200 response carrying a cached body"""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.encoding = 'utf-8'
+    response._content = entry['body'].encode('utf-8')
+    response.headers['Content-Type'] = 'application/json'
+    return response
+
+def mount(adapter):
+    """Send every request of the sessions created from now on through this requests adapter"""
+    TRANSPORT['adapter'] = adapter
+
+def close():
+    """Close every pooled session and save the calls of every token"""
+    with SESSIONS_LOCK:
+        for session in SESSIONS.values():
+            session.close()
+        SESSIONS.clear()
+        POOL['adapter'] = None
+
+        for limiter in LIMITERS.values():
+            limiter.save()
@@ -0,0 +1,26 @@
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+def ordered_map(func, items, workers):
+    """
+    Yield func(item) for every item, in the same order as items, while running
+    up to `workers` calls at the same time. Only a small window of results is
+    held in memory, so the caller can write them out as they arrive.
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+
+        for item in items:
+            pending.append(executor.submit(func, item))
+
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
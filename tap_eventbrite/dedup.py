@@ -0,0 +1,155 @@
+"""
+Fingerprint store: suppresses records whose flattened content did not change
+since the tap last emitted them.
+
+One SQLite table holds a 16-byte digest per (stream, key properties). A
+record is emitted when its digest is new or different. New digests are only
+committed after the next STATE message, and never otherwise, so a run that
+dies before its STATE emits the same records again next time instead of
+losing them.
+
+The table keeps at most max_rows rows: at the end of a run the rows least
+recently seen are deleted and the file is shrunk. Rebuild the store
+(DEDUP_REBUILD, or delete the file) whenever the destination tables are
+reset, otherwise unchanged records would never be sent again.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import singer
+
+LOGGER = singer.get_logger()
+
+DEFAULT_MAX_ROWS = 1000000
+
+# The largest IN (...) list sent to SQLite at once
+LOOKUP_BATCH = 500
+
+class FingerprintStore():
+    def __init__(self, path, max_rows=DEFAULT_MAX_ROWS, rebuild=False):
+        if rebuild and os.path.exists(path):
+            LOGGER.info("Rebuilding the fingerprint store {}".format(path))
+            os.remove(path)
+
+        self.path = path
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.run = int(time.time())
+        self.pending = {}
+        self.seen = []
+
+        import sqlite3
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # Must be set before the first table, so deleted rows can be given back to the disk
+        self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints ("
+            " stream TEXT NOT NULL, key TEXT NOT NULL, digest BLOB NOT NULL, seen INTEGER NOT NULL,"
+            " PRIMARY KEY (stream, key)) WITHOUT ROWID")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS fingerprints_seen ON fingerprints (seen)")
+        self.connection.commit()
+
+    def lookup(self, stream_id, key_properties, records):
+        """
+        The (record, key, digest, stored digest) of every record. Only reads the
+        store, so it runs outside output.LOCK.
+        """
+        fingerprints = []
+        for record in records:
+            key = json.dumps([record.get(name) for name in key_properties], default=str)
+            content = json.dumps(record, sort_keys=True, separators=(',', ':'), default=str)
+            fingerprints.append((key, hashlib.blake2b(content.encode(), digest_size=16).digest()))
+
+        stored = {}
+        keys = [key for key, digest in fingerprints]
+        with self.lock:
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[start:start + LOOKUP_BATCH]
+                rows = self.connection.execute(
+                    "SELECT key, digest FROM fingerprints WHERE stream = ? AND key IN ({})".format(",".join("?" * len(batch))),
+                    [stream_id] + batch)
+                stored.update(rows)
+
+        return [(record, key, digest, stored.get(key)) for record, (key, digest) in zip(records, fingerprints)]
+
+    def changed(self, stream_id, fingerprints):
+        """
+        The records to emit, from lookup(): the ones whose fingerprint is new or
+        different. Call it under output.LOCK with the writes of the records it
+        returns, so no STATE commits the fingerprint of a record not written yet.
+        """
+        with self.lock:
+            emitted = []
+            for record, key, digest, stored in fingerprints:
+                # Emitted earlier in this run, or in an earlier run
+                last = self.pending.get((stream_id, key), stored)
+                if last == digest:
+                    self.seen.append((self.run, stream_id, key))
+                else:
+                    self.pending[(stream_id, key)] = digest
+                    emitted.append(record)
+            return emitted
+
+    def commit(self):
+        """Store the fingerprints of every record emitted so far, once its STATE is out"""
+        with self.lock:
+            if self.pending:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO fingerprints (stream, key, digest, seen) VALUES (?, ?, ?, ?)",
+                    [(stream_id, key, digest, self.run) for (stream_id, key), digest in self.pending.items()])
+            if self.seen:
+                self.connection.executemany("UPDATE fingerprints SET seen = ? WHERE stream = ? AND key = ?", self.seen)
+            self.connection.commit()
+            self.pending = {}
+            self.seen = []
+
+    def close(self):
+        """
+        Trim the store to max_rows and give the freed pages back to the disk.
+        Fingerprints of records no STATE covers are dropped, whether the run
+        failed or not, so those records are emitted again by the next run.
+        """
+        with self.lock:
+            if self.pending:
+                LOGGER.info("Dropping {} fingerprint(s) of records sent after the last STATE".format(len(self.pending)))
+            self.pending = {}
+            if self.seen:
+                self.connection.executemany("UPDATE fingerprints SET seen = ? WHERE stream = ? AND key = ?", self.seen)
+                self.connection.commit()
+            self.seen = []
+
+            rows = self.connection.execute("SELECT count(*) FROM fingerprints").fetchone()[0]
+            if rows > self.max_rows:
+                LOGGER.info("Fingerprint store over {} rows, deleting the {} least recently seen".format(self.max_rows, rows - self.max_rows))
+                self.connection.execute(
+                    "DELETE FROM fingerprints WHERE (stream, key) IN (SELECT stream, key FROM fingerprints ORDER BY seen LIMIT ?)",
+                    (rows - self.max_rows,))
+                self.connection.commit()
+                self.connection.execute("PRAGMA incremental_vacuum")
+            self.connection.close()
+
+STORE = {'store': None} # Off unless DEDUP_DB is set
+
+def configure(config):
+    """
+    DEDUP_DB -- path of the fingerprint store, turns record deduplication on
+    DEDUP_MAX_ROWS -- fingerprints kept, the least recently seen go first (default 1000000)
+    DEDUP_REBUILD -- start the store over, e.g. after the destination was reset
+    """
+    close()
+    if config.get('DEDUP_DB'):
+        STORE['store'] = FingerprintStore(
+            config['DEDUP_DB'],
+            int(config.get('DEDUP_MAX_ROWS', DEFAULT_MAX_ROWS)),
+            bool(config.get('DEDUP_REBUILD', False)))
+
+def commit():
+    if STORE['store'] is not None:
+        STORE['store'].commit()
+
+def close():
+    if STORE['store'] is not None:
+        STORE['store'].close()
+        STORE['store'] = None
@@ -1,27 +1,84 @@
-import requests
 import time
 import os
 import singer
 import json  
 
+from tap_eventbrite import client
+
 LOGGER = singer.get_logger() 
 
-def events_call(token, org, continue_token):
-    url = "https://www.eventbriteapi.com/v3/organizations/370069590777/events/?page_size=100"
+# Expansions the events endpoint accepts, used when the schema has fields under them
+EXPANSIONS = ["logo", "venue", "organizer", "format", "category", "subcategory", "bookmark_info",
+              "refund_policy", "ticket_availability", "external_ticketing", "music_properties",
+              "publish_settings", "basic_inventory_info", "event_sales_status", "checkout_settings",
+              "listing_properties", "ticket_classes"]
+
+DEFAULT_PAGE_SIZE = 100
+
+def events_url(org, continue_token, expand=None, page_size=DEFAULT_PAGE_SIZE):
+    url = "https://www.eventbriteapi.com/v3/organizations/{}/events/?page_size={}".format(org, page_size or DEFAULT_PAGE_SIZE)
 
     if len(continue_token) > 0:
         url = url + "&continuation={}".format(continue_token)
 
-    headers = {
-        'authorization': "Bearer {}".format(token)
-    }
+    if expand:
+        url = url + "&expand={}".format(",".join(expand))
 
-    response = requests.request("GET", url, headers=headers)
+    return url
+
+def events_call(token, org, continue_token, expand=None, page_size=DEFAULT_PAGE_SIZE):
+    url = events_url(org, continue_token, expand, page_size)
+    response = client.get(url, token, "events", org)
 
     if response.status_code == 200:
-        event_json = response.json()
+        event_json = client.page(response, "events", "events", org)
         return event_json
 
     else:
         LOGGER.info("An error occerred when calling Events API!")
         return None
+
+class EventIndex():
+    """
+    The events seen by the events stream, for sales_reports: one entry per
+    event id, in the order they were first seen, holding only the start.utc and
+    end.utc strings of the event.
+    """
+    def __init__(self):
+        self.events = {}
+
+    def add(self, record):
+        start = record.get('start') or {}
+        end = record.get('end') or {}
+        if record['id'] not in self.events:
+            self.events[record['id']] = (start.get('utc'), end.get('utc'))
+
+    def clear(self):
+        self.events.clear()
+
+    def __contains__(self, event_id):
+        return event_id in self.events
+
+    def end_utc(self, event_id):
+        """end.utc of an event, None when it has none or was not seen"""
+        return self.events.get(event_id, (None, None))[1]
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def selling_since(self, window_start):
+        """
+        Ids of the events whose sales window overlaps [window_start, now].
+        window_start(event_id) returns the start of the sync window for that event,
+        or None to keep it. Sales end when the event ends, so an event that
+        ended before the window started has nothing new to report.
+        """
+        event_ids = []
+        for event_id, (start_utc, end_utc) in self.events.items():
+            since = window_start(event_id)
+            if since is None or not end_utc or end_utc >= since:
+                event_ids.append(event_id)
+        return event_ids
@@ -1,12 +1,17 @@
-import requests
 import time
 import os
 import singer
 import json  
 
+from tap_eventbrite import client
+
 LOGGER = singer.get_logger() 
 
-def orders_call(token, org, continue_token, changed_since = None):
+# Expansions the orders endpoint accepts, used when the schema has fields under them
+EXPANSIONS = ["event", "attendees", "merchandise", "concierge", "refund_requests", "survey",
+              "survey_responses", "answers", "ticket_buyer_settings", "contact_list_preferences"]
+
+def orders_url(org, continue_token, changed_since = None, expand=None, page_size=None):
     if changed_since is not None:
         date = changed_since
     else:
@@ -17,14 +22,20 @@ def orders_call(token, org, continue_token, changed_since = None):
     if len(continue_token) > 0:
         url = url + "&continuation={}".format(continue_token)
 
-    headers = {
-        'authorization': "Bearer {}".format(token)
-    }
+    if expand:
+        url = url + "&expand={}".format(",".join(expand))
+
+    if page_size:
+        url = url + "&page_size={}".format(page_size)
+
+    return url
 
-    response = requests.request("GET", url, headers=headers)
+def orders_call(token, org, continue_token, changed_since = None, expand=None, page_size=None):
+    url = orders_url(org, continue_token, changed_since, expand, page_size)
+    response = client.get(url, token, "orders", org)
 
     if response.status_code == 200:
-        event_json = response.json()
+        event_json = client.page(response, "orders", "orders", org)
         return event_json
 
     else:
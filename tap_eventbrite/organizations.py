@@ -0,0 +1,66 @@
+"""
+Several Eventbrite organizations synced by one process.
+
+ORGANIZATIONS lists {"ORG_ID": ..., "EVENTBRITE_TOKEN": ...} pairs. Without
+it the tap syncs the single ORG_ID with EVENTBRITE_TOKEN, as before.
+
+Every organization runs the organization streams (events, sales_reports,
+attendees, orders) with its own copy of the config, whose ORG_ID and
+EVENTBRITE_TOKEN are that organization's, and its records are tagged with
+org_id. Categories and subcategories are Eventbrite's global taxonomy: they
+are fetched once, with the first organization's token.
+
+With ORGANIZATIONS, the bookmarks of an organization are kept under
+state["organizations"][ORG_ID] and the taxonomy's at the top of the state.
+"""
+from tap_eventbrite import output
+
+TAXONOMY_STREAMS = ("categories", "subcategories")
+
+def get_organizations(config):
+    """(ORG_ID, EVENTBRITE_TOKEN) of every organization to sync"""
+    if config.get('ORGANIZATIONS'):
+        organizations = []
+        for organization in config['ORGANIZATIONS']:
+            missing = [key for key in ('ORG_ID', 'EVENTBRITE_TOKEN') if not organization.get(key)]
+            if missing:
+                raise Exception("ORGANIZATIONS entry is missing required keys: {}".format(missing))
+            organizations.append((str(organization['ORG_ID']), organization['EVENTBRITE_TOKEN']))
+
+        org_ids = [org_id for org_id, token in organizations]
+        if len(set(org_ids)) != len(org_ids):
+            raise Exception("ORGANIZATIONS lists an ORG_ID more than once")
+        return organizations
+
+    missing = [key for key in ('ORG_ID', 'EVENTBRITE_TOKEN') if not config.get(key)]
+    if missing:
+        raise Exception("Config is missing required keys: {} (or ORGANIZATIONS)".format(missing))
+    return [(str(config['ORG_ID']), config['EVENTBRITE_TOKEN'])]
+
+def org_state(config, state, org_id):
+    """The state the streams of this organization read and write their bookmarks in"""
+    if not config.get('ORGANIZATIONS'):
+        return state
+
+    organizations = state.setdefault('organizations', {})
+    scoped = organizations.get(org_id)
+    if not isinstance(scoped, output.ScopedState):
+        scoped = organizations[org_id] = output.ScopedState(state, scoped or {})
+    return scoped
+
+def plan(config, state, streams):
+    """
+    The (config, state, stream) of every stream to sync, in the order of
+    streams: an organization stream once per organization, the taxonomy once.
+    """
+    organizations = get_organizations(config)
+    jobs = []
+    for stream in streams:
+        if stream['tap_stream_id'] in TAXONOMY_STREAMS:
+            org_id, token = organizations[0]
+            jobs.append((dict(config, ORG_ID=org_id, EVENTBRITE_TOKEN=token), state, stream))
+            continue
+
+        for org_id, token in organizations:
+            jobs.append((dict(config, ORG_ID=org_id, EVENTBRITE_TOKEN=token), org_state(config, state, org_id), stream))
+    return jobs
@@ -0,0 +1,162 @@
+import json
+import sys
+import threading
+import singer
+
+from tap_eventbrite import dedup
+
+LOGGER = singer.get_logger()
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Streams can run on several threads. Every Singer message and every change to
+# the state goes through this lock, so lines never interleave on stdout and a
+# STATE message never sees a half-updated bookmark.
+LOCK = threading.RLock()
+
+ENGINE = {'writer': None} # None writes through singer-python, one flush per message
+
+class BufferedWriter():
+    """
+    Fast Singer output: records are encoded by a C JSON encoder and written to
+    stdout in blocks of buffer_size characters.
+
+    The stdlib encoder uses the same settings as singer-python, so messages are
+    byte-for-byte identical. The orjson encoder is faster still but writes
+    compact JSON (no spaces after separators, non-ASCII characters unescaped),
+    which is the same data but not the same bytes.
+    """
+    def __init__(self, encoder="json", buffer_size=DEFAULT_BUFFER_SIZE):
+        if encoder == "orjson":
+            try:
+                import orjson
+            except ImportError:
+                LOGGER.info("orjson is not installed, using the json encoder")
+                encoder = "json"
+
+        if encoder == "orjson":
+            self.encode = lambda value: orjson.dumps(value).decode()
+            self.record_prefix = '{{"type":"RECORD","stream":{},"record":'
+        else:
+            self.encode = json.JSONEncoder(ensure_ascii=True, allow_nan=False).encode
+            self.record_prefix = '{{"type": "RECORD", "stream": {}, "record": '
+
+        self.buffer_size = buffer_size
+        self.prefixes = {}
+        self.chunks = []
+        self.size = 0
+
+    def write_record(self, stream_id, record):
+        prefix = self.prefixes.get(stream_id)
+        if prefix is None:
+            prefix = self.prefixes[stream_id] = self.record_prefix.format(self.encode(stream_id))
+        self.write(prefix + self.encode(record) + "}\n")
+
+    def write_message(self, message):
+        self.write(self.encode(message.asdict()) + "\n")
+
+    def write(self, line):
+        self.chunks.append(line)
+        self.size += len(line)
+        if self.size >= self.buffer_size:
+            self.flush_buffer()
+
+    def flush_buffer(self):
+        if self.chunks:
+            sys.stdout.write("".join(self.chunks))
+            self.chunks = []
+            self.size = 0
+
+    def flush(self):
+        self.flush_buffer()
+        sys.stdout.flush()
+
+    def close(self):
+        self.flush()
+
+def configure(config):
+    """
+    FAST_OUTPUT -- buffer stdout and encode records with a C JSON encoder
+    FAST_OUTPUT_ENCODER -- "json" (default, same bytes as singer-python) or "orjson"
+    FAST_OUTPUT_BUFFER_SIZE -- characters kept before writing to stdout (default 1 MiB)
+    OUTPUT_DIR -- write the records to files in this directory instead, see tap_eventbrite.sink
+    OUTPUT_FORMAT -- "ndjson" (default, gzipped) or "parquet"
+    OUTPUT_ROW_GROUP_SIZE -- records per Parquet row group (default 10000)
+    OUTPUT_FILE_ROWS -- records per file, a stream's file is closed and a new one started past it (default 1000000)
+    OUTPUT_COMPRESSION_LEVEL -- gzip level of the NDJSON files, 0 to 9 (default 6)
+    """
+    with LOCK:
+        close()
+        if config.get('OUTPUT_DIR'):
+            from tap_eventbrite.sink import FileSink, DEFAULT_ROW_GROUP_SIZE, DEFAULT_FILE_ROWS, DEFAULT_COMPRESSION_LEVEL
+            ENGINE['writer'] = FileSink(
+                config['OUTPUT_DIR'],
+                config.get('OUTPUT_FORMAT', "ndjson"),
+                int(config.get('OUTPUT_ROW_GROUP_SIZE', DEFAULT_ROW_GROUP_SIZE)),
+                int(config.get('OUTPUT_FILE_ROWS', DEFAULT_FILE_ROWS)),
+                int(config.get('OUTPUT_COMPRESSION_LEVEL', DEFAULT_COMPRESSION_LEVEL)))
+        elif config.get('FAST_OUTPUT'):
+            ENGINE['writer'] = BufferedWriter(
+                config.get('FAST_OUTPUT_ENCODER', "json"),
+                int(config.get('FAST_OUTPUT_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)))
+        else:
+            ENGINE['writer'] = None
+
+def write_schema(stream_id, schema, key_properties):
+    with LOCK:
+        if ENGINE['writer'] is None:
+            singer.write_schema(stream_id, schema, key_properties)
+        else:
+            ENGINE['writer'].write_message(singer.SchemaMessage(stream=stream_id, schema=schema, key_properties=key_properties))
+
+def write_record(stream_id, record):
+    with LOCK:
+        if ENGINE['writer'] is None:
+            singer.write_record(stream_id, record)
+        else:
+            ENGINE['writer'].write_record(stream_id, record)
+
+class ScopedState(dict):
+    """
+    The part of the state kept for one organization, nested in the whole
+    state. Bookmarks are read and written in it, write_state() writes the
+    whole state.
+    """
+    def __init__(self, root, values):
+        super().__init__(values)
+        self.root = root
+
+def write_state(state):
+    """
+    Every record written before this STATE reaches stdout before it. The
+    fingerprints of those records are committed right after it.
+    """
+    if isinstance(state, ScopedState):
+        state = state.root
+
+    with LOCK:
+        if ENGINE['writer'] is None:
+            singer.write_state(state)
+        else:
+            ENGINE['writer'].write_message(singer.StateMessage(value=state))
+            ENGINE['writer'].flush()
+        dedup.commit()
+
+def flush():
+    with LOCK:
+        if ENGINE['writer'] is not None:
+            ENGINE['writer'].flush()
+
+def close():
+    """Write out everything at the end of the run: the buffered messages, or the open files"""
+    with LOCK:
+        if ENGINE['writer'] is not None:
+            ENGINE['writer'].close()
+
+def write_bookmark(state, stream_id, key, value):
+    with LOCK:
+        singer.write_bookmark(state, stream_id, key, value)
+
+def clear_bookmark(state, stream_id, key):
+    with LOCK:
+        singer.clear_bookmark(state, stream_id, key)
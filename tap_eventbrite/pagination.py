@@ -0,0 +1,171 @@
+import queue
+import threading
+import time
+
+DEFAULT_PREFETCH = 1
+
+class _Failure():
+    """Carries an exception from the fetching thread to the consumer"""
+    def __init__(self, error):
+        self.error = error
+
+def next_token(page):
+    """Continuation token of the page after this one, or None on the last page"""
+    if page is None:
+        return None
+    return page['pagination'].get('continuation')
+
+def iter_pages(fetch, continue_token="", prefetch=DEFAULT_PREFETCH):
+    """
+    Yield every page of a paginated endpoint, starting at continue_token.
+    fetch(continue_token) returns one page, or None when the call failed, which
+    is yielded and ends the iteration.
+
+    With prefetch above 0, a background thread requests page N+1 while the
+    caller is still working on page N. At most `prefetch` pages wait in the
+    queue, so memory stays bounded however long the stream is. A streamed page
+    whose pagination comes after its records is never read by that thread:
+    the next page is only requested once the caller has read its records.
+    """
+    if prefetch <= 0:
+        while True:
+            page = fetch(continue_token)
+            yield page
+            continue_token = next_token(page)
+            if continue_token is None:
+                return
+
+    pages = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        # Wait for room in the queue, unless the consumer went away
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce(continue_token):
+        try:
+            while not stop.is_set():
+                page = fetch(continue_token)
+                # A streamed page only has its pagination already if it came before the records
+                known = page is None or 'pagination' in page
+                put((page, known))
+                if not known:
+                    return
+                continue_token = next_token(page)
+                if continue_token is None:
+                    return
+        except BaseException as error:
+            # Re-raised by the consumer, the thread itself must never die silently
+            put(_Failure(error))
+
+    def start(continue_token):
+        threading.Thread(target=produce, args=(continue_token,), daemon=True).start()
+
+    start(continue_token)
+    try:
+        while True:
+            item = pages.get()
+            if isinstance(item, _Failure):
+                raise item.error
+            page, known = item
+            yield page
+            continue_token = next_token(page)
+            if continue_token is None:
+                return
+            if not known:
+                # The caller has read the records, fetching goes on from here
+                start(continue_token)
+    finally:
+        stop.set()
+
+# Bounds and targets of the adaptive page size, which starts at the API's default
+DEFAULT_API_PAGE_SIZE = 50
+DEFAULT_MIN_PAGE_SIZE = 10
+DEFAULT_MAX_PAGE_SIZE = 200
+DEFAULT_TARGET_PAGE_SECONDS = 2.0
+DEFAULT_TARGET_PAGE_BYTES = 4 * 1024 * 1024
+
+class PageSizer():
+    """
+    The page_size of a stream's next request. Fixed unless adaptive: then
+    every page's latency and payload size is compared with the targets, and the
+    page size doubles at most, or halves at most, so the slower of the two
+    lands near its target. It stays within [minimum, maximum].
+    """
+    def __init__(self, size=None, adaptive=False, minimum=DEFAULT_MIN_PAGE_SIZE, maximum=DEFAULT_MAX_PAGE_SIZE,
+                 target_seconds=DEFAULT_TARGET_PAGE_SECONDS, target_bytes=DEFAULT_TARGET_PAGE_BYTES):
+        self.adaptive = adaptive
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.lock = threading.Lock()
+        self.size = size
+        if adaptive:
+            self.size = min(max(size or DEFAULT_API_PAGE_SIZE, minimum), maximum)
+
+    def observe(self, seconds, size_bytes):
+        """Adjust the page size after one page of the current size took seconds and size_bytes"""
+        if not self.adaptive:
+            return
+
+        ratios = []
+        if seconds > 0:
+            ratios.append(self.target_seconds / seconds)
+        if size_bytes > 0:
+            ratios.append(self.target_bytes / size_bytes)
+        if not ratios:
+            return
+
+        # Small deviations are noise, the page size only moves on clear ones
+        ratio = min(max(min(ratios), 0.5), 2.0)
+        if 0.8 <= ratio <= 1.25:
+            return
+
+        with self.lock:
+            self.size = min(max(int(self.size * ratio), self.minimum), self.maximum)
+
+    def measured(self, fetch, metrics):
+        """
+        fetch, observing the latency and payload size of every page. Time spent
+        waiting for the rate limiter, from the stream's metrics, is not latency.
+        The size is the page's own: a streamed page is observed once its body
+        is read, so pages downloaded in parallel are never mixed up.
+        """
+        if not self.adaptive:
+            return fetch
+
+        def fetch_page(continue_token):
+            throttled = metrics.throttle_seconds
+            started = time.monotonic()
+            page = fetch(continue_token)
+            seconds = time.monotonic() - started - (metrics.throttle_seconds - throttled)
+            if page is not None:
+                page.when_read(lambda: self.observe(seconds, page.size))
+            return page
+
+        return fetch_page
+
+def get_page_sizer(config, stream_id, default=None):
+    """
+    PAGE_SIZE -- page size of every list endpoint, or a dict of page sizes by stream
+    PAGE_SIZE_ADAPTIVE -- grow or shrink the page size from the observed latency and payload size
+    PAGE_SIZE_MIN / PAGE_SIZE_MAX -- bounds of the adaptive page size (default 10 / 200)
+    PAGE_TARGET_SECONDS / PAGE_TARGET_BYTES -- what one page should take (default 2 / 4 MiB)
+    """
+    size = config.get('PAGE_SIZE', default)
+    if isinstance(size, dict):
+        size = size.get(stream_id, default)
+
+    return PageSizer(
+        int(size) if size else None,
+        bool(config.get('PAGE_SIZE_ADAPTIVE', False)),
+        int(config.get('PAGE_SIZE_MIN', DEFAULT_MIN_PAGE_SIZE)),
+        int(config.get('PAGE_SIZE_MAX', DEFAULT_MAX_PAGE_SIZE)),
+        float(config.get('PAGE_TARGET_SECONDS', DEFAULT_TARGET_PAGE_SECONDS)),
+        int(config.get('PAGE_TARGET_BYTES', DEFAULT_TARGET_PAGE_BYTES)))
@@ -0,0 +1,149 @@
+import collections
+import email.utils
+import hashlib
+import os
+import random
+import threading
+import time
+import singer
+
+LOGGER = singer.get_logger()
+
+# Eventbrite's documented quota for one OAuth token
+DEFAULT_CALLS_PER_HOUR = 2000
+DEFAULT_CALLS_PER_DAY = 48000
+
+class RateLimiter():
+    """
+    Sliding-window limiter for one token. Every window is (limit, period in
+    seconds). acquire() blocks until a call fits in all windows, so requests
+    are paced below the quota instead of running into 429 responses.
+
+    With path, the times of the token's calls over the last day are read from
+    that file when the limiter is created and merged back into it by save(),
+    so runs of the tap one after the other share the quota. Runs at the same
+    time only see each other's calls once the earlier one has saved.
+    """
+    def __init__(self, calls_per_hour=DEFAULT_CALLS_PER_HOUR, calls_per_day=DEFAULT_CALLS_PER_DAY, path=None):
+        self.windows = [
+            (calls_per_hour, 3600, collections.deque()),
+            (calls_per_day, 86400, collections.deque()),
+        ]
+        self.lock = threading.Lock()
+        self.resume_at = 0.0
+        self.throttled_seconds = 0.0
+        self.path = path
+        # Calls not saved to path yet
+        self.unsaved = []
+
+        if path is not None:
+            now = time.time()
+            for called_at in read_calls(path, now - 86400):
+                for limit, period, calls in self.windows:
+                    if called_at > now - period:
+                        calls.append(called_at)
+
+    def reserve(self):
+        """
+        Record one call and return 0 when it is allowed now, otherwise return
+        the seconds to wait before asking again, without recording anything
+        """
+        with self.lock:
+            now = time.time()
+            wait = self.resume_at - now
+
+            for limit, period, calls in self.windows:
+                while calls and calls[0] <= now - period:
+                    calls.popleft()
+                if len(calls) >= limit:
+                    wait = max(wait, calls[0] + period - now)
+
+            if wait <= 0:
+                for limit, period, calls in self.windows:
+                    calls.append(now)
+                if self.path is not None:
+                    self.unsaved.append(now)
+                return 0.0
+
+            self.throttled_seconds += wait
+            return wait
+
+    def acquire(self):
+        """Wait until one more call is allowed and record it, return the seconds waited"""
+        waited = 0.0
+        while True:
+            wait = self.reserve()
+            if wait <= 0:
+                return waited
+
+            LOGGER.info("Rate limit reached, waiting {:.1f} second(s)".format(wait))
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """Hold every caller of this token back, e.g. after a 429 with Retry-After"""
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.time() + seconds)
+
+    def save(self):
+        """Add the calls not saved yet to the file at path, under a lock shared with other runs"""
+        if self.path is None:
+            return
+
+        import fcntl
+
+        with self.lock:
+            calls, self.unsaved = self.unsaved, []
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            since = time.time() - 86400
+            # Calls older than a day are dropped from the file
+            calls = sorted(read_calls(self.path, since) + calls)
+            file.seek(0)
+            file.truncate()
+            file.write("".join("{!r}\n".format(called_at) for called_at in calls if called_at > since))
+
+def calls_path(directory, token):
+    """The file keeping the call times of a token, named after a hash of it"""
+    return os.path.join(directory, hashlib.sha256(token.encode()).hexdigest()[:32] + ".calls")
+
+def read_calls(path, since):
+    """The call times after since in the file at path, oldest first"""
+    try:
+        with open(path) as file:
+            lines = file.read().split()
+    except FileNotFoundError:
+        return []
+
+    calls = []
+    for line in lines:
+        try:
+            called_at = float(line)
+        except ValueError:
+            continue
+        if called_at > since:
+            calls.append(called_at)
+    return sorted(calls)
+
+def backoff_delay(attempt, factor, maximum):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(maximum, factor * (2 ** attempt)))
+
+def retry_after_delay(response):
+    """Seconds asked for by a Retry-After header, or None"""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
@@ -1,26 +1,80 @@
-import requests
 import time
 import os
 import singer
 import json  
 
+from tap_eventbrite import client
+
 LOGGER = singer.get_logger() 
 
-def sales_report_call(token, org, event_id, loading_new_data):
-    url = "https://www.eventbriteapi.com/v3/reports/sales/?event_ids={}".format(event_id)
+def sales_report_url(org, event_ids, loading_new_data, start_date=None):
+    if not isinstance(event_ids, (list, tuple)):
+        event_ids = [event_ids]
+
+    url = "https://www.eventbriteapi.com/v3/reports/sales/?event_ids={}".format(",".join(event_ids))
+
+    if len(event_ids) > 1:
+        # One breakdown entry per event, so rows can be mapped back to their event
+        url = url + "&group_by=event"
 
-    if loading_new_data:
+    if start_date is not None:
+        url = url + "&date_facet=day&start_date={}".format(start_date)
+    elif loading_new_data:
         url = url + "&date_facet=day&period=1"
 
-    headers = {
-        'authorization': "Bearer {}".format(token)
-    }
+    return url
 
-    response = requests.request("GET", url, headers=headers)
+def sales_report_call(token, org, event_ids, loading_new_data, start_date=None):
+    url = sales_report_url(org, event_ids, loading_new_data, start_date)
+
+    response = client.get(url, token, "sales_reports", org)
 
     if response.status_code == 200:
-        return response.json()
+        return client.page(response, "data", "sales_reports", org)
     
     else:
         LOGGER.info("An error occerred when calling Sales Report API!")
         return None
+
+def split_sales_report(records, event_ids):
+    """
+    Yield the report rows with their event_id set, as they are read.
+    A single-event report is returned as is. A report for several events is
+    grouped by event (group_by=event): every date row carries one breakdown
+    entry per event, whose name is the event id,
+
+        {"date": ..., "date_localized": ..., "totals": {...},
+         "breakdown": [{"name": "<event id>", "totals": {...}}, ...]}
+
+    and is split into one row per breakdown entry, carrying that event's
+    totals. An entry that is not one of the requested events stops the sync
+    rather than losing its rows.
+    """
+    if not isinstance(event_ids, (list, tuple)):
+        event_ids = [event_ids]
+
+    if records is None:
+        LOGGER.info("Skipping sales report for event(s) {}!".format(",".join(event_ids)))
+        return
+
+    if len(event_ids) == 1:
+        for row in records['data']:
+            row['event_id'] = event_ids[0]
+            yield row
+        return
+
+    for row in records['data']:
+        for breakdown in row.get('breakdown') or []:
+            event_id = breakdown.get('name')
+            if event_id not in event_ids:
+                raise client.EventbriteError(
+                    "Sales report breakdown {!r} of {} is none of the requested events {}, "
+                    "set SALES_REPORTS_BATCH_SIZE to 1 to report one event per request".format(
+                        event_id, row.get('date'), ",".join(event_ids)))
+
+            yield {
+                'date': row.get('date'),
+                'date_localized': row.get('date_localized'),
+                'totals': breakdown.get('totals'),
+                'event_id': event_id,
+            }
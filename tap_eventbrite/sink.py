@@ -0,0 +1,448 @@
+"""
+File output: the flattened records are written to local files instead of
+Singer RECORD messages, for loading straight into a warehouse.
+
+Every stream has one open part file at a time, partitioned as
+
+    <directory>/<stream>/run_date=<YYYY-MM-DD>/<run id>-<sequence>.<parquet|ndjson.gz>
+
+and written under a temporary name. A part is closed and renamed into place
+once it holds file_rows records, or at the end of the run. Parquet parts are
+written one row group of row_group_size records at a time.
+
+Before every STATE message, the open parts are flushed and fsynced, and the
+run's manifest, manifests/<run id>.json, is rewritten: the schema and key
+properties of every stream, every complete file with its stream, row count
+and size, and every open part with the records the STATE covers so far. An
+NDJSON part is flushed as it is, a Parquet part keeps those records in a
+gzipped NDJSON journal next to it until its row groups are written and it is
+closed. STATE messages still go to stdout, SCHEMA and RECORD messages do not.
+
+When a run dies, the next run over the directory finishes its open parts from
+what was flushed, lists them as complete in that run's manifest, and deletes
+the records written after its last STATE. A loader only reads the complete
+files of the manifests.
+
+Every run holds an exclusive lock on manifests/<run id>.lock until it ends,
+which the system releases if it dies. Only the runs whose lock is free are
+recovered, so runs sharing the directory leave each other's files alone.
+"""
+import datetime
+import glob
+import gzip
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import uuid
+import zlib
+import singer
+
+LOGGER = singer.get_logger()
+
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+DEFAULT_FILE_ROWS = 1000000
+
+# gzip level of the NDJSON parts: level 9 is several times slower for a few
+# percent smaller files
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# Records encoded and written to a part together
+WRITE_BATCH_SIZE = 1000
+
+MANIFESTS = "manifests"
+
+class NdjsonPart():
+    """
+    One gzipped NDJSON file, written under a temporary name until closed.
+    sync() makes what was written so far readable after a crash.
+    """
+    extension = "ndjson.gz"
+
+    def __init__(self, path, schema=None, row_group_size=None, compresslevel=DEFAULT_COMPRESSION_LEVEL):
+        self.path = path
+        self.rows = 0
+        self.raw = open(path + ".tmp", 'wb')
+        self.file = io.TextIOWrapper(gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=compresslevel), encoding='utf-8')
+        self.encode = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode
+
+    def write(self, records):
+        self.file.write("".join(self.encode(record) + "\n" for record in records))
+        self.rows += len(records)
+
+    def sync(self):
+        """Flush the compressed stream and fsync it, return the committed (journal path, bytes)"""
+        # A gzip sync flush ends on a byte boundary, so the file decompresses up to here
+        self.file.flush()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        return self.raw.name, self.raw.tell()
+
+    def close(self):
+        self.file.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def discard(self):
+        pass
+
+class ParquetPart():
+    """
+    One Parquet file, one row group per row_group_size records, under a
+    temporary name until closed. The records of the row group being filled
+    are kept in memory and in a journal that sync() makes durable.
+    """
+    extension = "parquet"
+
+    def __init__(self, path, schema, row_group_size=DEFAULT_ROW_GROUP_SIZE, journal=True):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.path = path
+        self.rows = 0
+        self.row_group_size = row_group_size
+        self.pending = []
+        self.fields = [(name, arrow_type(pyarrow, properties)) for name, properties in schema['properties'].items()]
+        self.schema = pyarrow.schema(self.fields)
+        self.writer = pyarrow.parquet.ParquetWriter(path + ".tmp", self.schema, compression='snappy')
+        self.journal = NdjsonPart(path + ".journal", compresslevel=1) if journal else None
+
+    def write(self, records):
+        if self.journal is not None:
+            self.journal.write(records)
+        self.pending.extend(records)
+        self.rows += len(records)
+        while len(self.pending) >= self.row_group_size:
+            self.write_row_group(self.pending[:self.row_group_size])
+            self.pending = self.pending[self.row_group_size:]
+
+    def write_row_group(self, records):
+        columns = [self.column([record.get(name) for record in records], field_type) for name, field_type in self.fields]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(columns, schema=self.schema))
+
+    def column(self, values, field_type):
+        pyarrow = self.pyarrow
+        try:
+            if pyarrow.types.is_timestamp(field_type):
+                # Flattened date-times are UTC ISO 8601 strings
+                return pyarrow.array(values, type=pyarrow.string()).cast(field_type)
+            return pyarrow.array(values, type=field_type)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError, ValueError):
+            # A value of another type than the schema's: stored as null rather than failing the file
+            return pyarrow.array([coerce(value, field_type, pyarrow) for value in values], type=field_type)
+
+    def sync(self):
+        return self.journal.sync()
+
+    def close(self):
+        if self.pending:
+            self.write_row_group(self.pending)
+            self.pending = []
+        self.writer.close()
+        with open(self.path + ".tmp", 'rb') as file:
+            os.fsync(file.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+    def discard(self):
+        """Delete the journal, once the closed file is listed in the manifest"""
+        if self.journal is not None:
+            self.journal.file.close()
+            self.journal.raw.close()
+            os.remove(self.journal.raw.name)
+            self.journal = None
+
+def arrow_type(pyarrow, properties):
+    """The Arrow type of a property of a Singer schema"""
+    types = properties.get('type', [])
+    if properties.get('format') == "date-time":
+        return pyarrow.timestamp('us', tz='UTC')
+    if "integer" in types:
+        return pyarrow.int64()
+    if "number" in types:
+        return pyarrow.float64()
+    if "boolean" in types:
+        return pyarrow.bool_()
+    return pyarrow.string()
+
+def coerce(value, field_type, pyarrow):
+    """value as field_type, or None when it cannot be converted"""
+    try:
+        if pyarrow.types.is_timestamp(field_type):
+            return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if pyarrow.types.is_integer(field_type):
+            return int(value)
+        if pyarrow.types.is_floating(field_type):
+            return float(value)
+        if pyarrow.types.is_boolean(field_type):
+            return value if isinstance(value, bool) else None
+        return None if value is None else str(value)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def read_journal(path, size):
+    """The records of the first size bytes of a synced gzipped NDJSON file"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    rest = b""
+    with open(path, 'rb') as file:
+        while size > 0:
+            chunk = file.read(min(size, 1024 * 1024))
+            if not chunk:
+                break
+            size -= len(chunk)
+            lines = (rest + decompressor.decompress(chunk)).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield json.loads(line)
+
+def lock(path):
+    """Open and lock the file at path without waiting, None when another process holds it"""
+    import fcntl
+    file = open(path, 'a')
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        file.close()
+        return None
+    return file
+
+def unlock(path, file):
+    os.remove(path)
+    file.close()
+
+def write_json(path, value):
+    """Replace the file at path with value, never leaving it half written"""
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(handle, 'w') as file:
+        json.dump(value, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+class FileSink():
+    """
+    Replaces the stdout writer of tap_eventbrite.output: the same
+    write_record / write_message / flush / close, called under output.LOCK.
+    """
+    def __init__(self, directory, file_format="ndjson", row_group_size=DEFAULT_ROW_GROUP_SIZE, file_rows=DEFAULT_FILE_ROWS,
+                 compresslevel=DEFAULT_COMPRESSION_LEVEL):
+        if not 0 <= compresslevel <= 9:
+            raise Exception("OUTPUT_COMPRESSION_LEVEL must be between 0 and 9, got {}".format(compresslevel))
+        if file_format == "parquet":
+            try:
+                import pyarrow.parquet
+            except ImportError:
+                LOGGER.info("pyarrow is not installed, writing NDJSON files")
+                file_format = "ndjson"
+
+        self.directory = directory
+        self.part_class = ParquetPart if file_format == "parquet" else NdjsonPart
+        self.row_group_size = row_group_size
+        self.file_rows = file_rows
+        self.compresslevel = compresslevel
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.run_date = now.strftime("%Y-%m-%d")
+        self.run_id = "{}-{}".format(now.strftime("%Y%m%dT%H%M%SZ"), uuid.uuid4().hex[:8])
+        self.sequence = 0
+        self.buffers = {}
+        self.parts = {}
+        # What the last STATE covers of every open part
+        self.committed = {}
+        # Closed parts whose journal is deleted once the manifest lists them
+        self.closed = []
+        self.changed = False
+
+        os.makedirs(os.path.join(directory, MANIFESTS), exist_ok=True)
+        self.lock = lock(self.lock_path(self.run_id))
+        self.recover()
+        self.manifest = {'run_id': self.run_id, 'streams': {}, 'files': [], 'open': []}
+
+    def write_record(self, stream_id, record):
+        buffer = self.buffers.setdefault(stream_id, [])
+        buffer.append(record)
+        if len(buffer) >= WRITE_BATCH_SIZE:
+            self.write_buffer(stream_id)
+
+    def write_message(self, message):
+        if isinstance(message, singer.SchemaMessage):
+            self.manifest['streams'][message.stream] = {'schema': message.schema, 'key_properties': message.key_properties}
+            self.changed = True
+        elif isinstance(message, singer.StateMessage):
+            # The files hold every record the state covers before it is written
+            self.commit()
+            singer.write_message(message)
+        else:
+            singer.write_message(message)
+
+    def write_buffer(self, stream_id):
+        records = self.buffers.get(stream_id)
+        if not records:
+            return
+
+        part = self.parts.get(stream_id)
+        if part is None:
+            directory = os.path.join(self.directory, stream_id, "run_date={}".format(self.run_date))
+            os.makedirs(directory, exist_ok=True)
+            self.sequence += 1
+            name = "{}-{:05d}.{}".format(self.run_id, self.sequence, self.part_class.extension)
+            path = os.path.join(directory, name)
+            if self.part_class is NdjsonPart:
+                part = NdjsonPart(path, compresslevel=self.compresslevel)
+            else:
+                part = ParquetPart(path, self.manifest['streams'][stream_id]['schema'], self.row_group_size)
+            self.parts[stream_id] = part
+
+        part.write(records)
+        self.buffers[stream_id] = []
+        self.changed = True
+
+        if part.rows >= self.file_rows:
+            self.close_part(stream_id)
+            self.write_manifest()
+
+    def close_part(self, stream_id):
+        part = self.parts.pop(stream_id)
+        self.committed.pop(stream_id, None)
+        part.close()
+        self.closed.append(part)
+        self.manifest['files'].append({
+            'stream': stream_id,
+            'path': os.path.relpath(part.path, self.directory),
+            'format': part.extension,
+            'rows': part.rows,
+            'bytes': os.path.getsize(part.path),
+            'run_id': self.run_id,
+        })
+
+    def write_manifest(self):
+        self.manifest['open'] = list(self.committed.values())
+        write_json(os.path.join(self.directory, MANIFESTS, "{}.json".format(self.run_id)), self.manifest)
+        for part in self.closed:
+            part.discard()
+        self.closed = []
+
+    def commit(self):
+        """Write every buffer, sync the open parts and list them in the manifest"""
+        for stream_id in list(self.buffers):
+            self.write_buffer(stream_id)
+
+        if not self.changed:
+            return
+
+        for stream_id, part in self.parts.items():
+            journal, size = part.sync()
+            self.committed[stream_id] = {
+                'stream': stream_id,
+                'path': os.path.relpath(part.path, self.directory),
+                'format': part.extension,
+                'rows': part.rows,
+                'journal': os.path.relpath(journal, self.directory),
+                'journal_bytes': size,
+            }
+        self.write_manifest()
+        self.changed = False
+
+    def flush(self):
+        sys.stdout.flush()
+
+    def close(self):
+        """Close every open part and list it in the manifest, at the end of the run"""
+        for stream_id in list(self.buffers):
+            self.write_buffer(stream_id)
+        for stream_id in list(self.parts):
+            self.close_part(stream_id)
+        if self.changed or self.closed:
+            self.write_manifest()
+            self.changed = False
+        if self.lock is not None:
+            unlock(self.lock_path(self.run_id), self.lock)
+            self.lock = None
+        sys.stdout.flush()
+
+    def lock_path(self, run_id):
+        return os.path.join(self.directory, MANIFESTS, "{}.lock".format(run_id))
+
+    def recover(self):
+        """Finish the open parts of the runs that died, delete what their last STATE did not cover"""
+        # The lock of every run seen, None while the run is alive
+        locks = {}
+
+        def dead(run_id):
+            if run_id not in locks:
+                locks[run_id] = lock(self.lock_path(run_id))
+            return locks[run_id] is not None
+
+        try:
+            for path in sorted(glob.glob(os.path.join(self.directory, MANIFESTS, "*.json"))):
+                with open(path) as file:
+                    manifest = json.load(file)
+                if not manifest.get('open') or not dead(manifest['run_id']):
+                    continue
+
+                # Read again under the lock, the run may have ended in between
+                with open(path) as file:
+                    manifest = json.load(file)
+                for entry in manifest['open']:
+                    LOGGER.info("{}: recovering {} rows of the unfinished file {}".format(entry['stream'], entry['rows'], entry['path']))
+                    manifest['files'].append(self.recover_part(manifest, entry))
+                manifest['open'] = []
+                write_json(path, manifest)
+
+            # Parts are named <run id>-<sequence>.<extension>.tmp
+            for path in glob.glob(os.path.join(self.directory, "*", "run_date=*", "*.tmp")):
+                if dead(os.path.basename(path).rsplit("-", 1)[0]):
+                    os.remove(path)
+        finally:
+            for run_id, file in locks.items():
+                if file is not None:
+                    unlock(self.lock_path(run_id), file)
+
+    def recover_part(self, manifest, entry):
+        """Write the committed records of an open part of a dead run to its file, return its manifest entry"""
+        path = os.path.join(self.directory, entry['path'])
+        journal = os.path.join(self.directory, entry['journal'])
+        recovering = journal + ".recovering"
+        parquet = entry['format'] == ParquetPart.extension
+
+        if os.path.exists(path):
+            # Closed by the dead run, which died before listing it
+            if parquet:
+                import pyarrow.parquet
+                rows = pyarrow.parquet.ParquetFile(path).metadata.num_rows
+            else:
+                with gzip.open(path, 'rb') as file:
+                    rows = sum(1 for line in file)
+        else:
+            if os.path.exists(journal):
+                os.replace(journal, recovering)
+
+            records = itertools.islice(read_journal(recovering, entry['journal_bytes']), entry['rows'])
+            if parquet:
+                part = ParquetPart(path, manifest['streams'][entry['stream']]['schema'], self.row_group_size, journal=False)
+            else:
+                part = NdjsonPart(path, compresslevel=self.compresslevel)
+            while True:
+                batch = list(itertools.islice(records, WRITE_BATCH_SIZE))
+                if not batch:
+                    break
+                part.write(batch)
+            part.close()
+            rows = part.rows
+
+        for leftover in (journal, recovering):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+        return {
+            'stream': entry['stream'],
+            'path': entry['path'],
+            'format': entry['format'],
+            'rows': rows,
+            'bytes': os.path.getsize(path),
+            'run_id': manifest['run_id'],
+        }
@@ -0,0 +1,175 @@
+"""
+Incremental parsing of the list endpoints' JSON pages.
+
+A page is one object holding the records array (attendees, orders, data...)
+and a few small members such as pagination. StreamedPage decodes the records
+one at a time while the body is downloaded, with the standard library's
+JSONDecoder.raw_decode, so only one record and the unread part of the current
+chunk are held in memory, and flattening starts with the first record.
+
+The other members are decoded when the page is created if they come before the
+records array, as Eventbrite sends them, so the continuation token is known
+before the records are read and the next page can be prefetched. Otherwise
+they are decoded once the records have been read, and asking for one of them
+earlier loads the remaining records in memory.
+"""
+import codecs
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = " \t\n\r"
+
+# What can follow the digits decoded so far when a chunk cuts a number
+NUMBER_CONTINUATIONS = ".eE+-"
+
+DECODER = json.JSONDecoder()
+
+class StreamedPage(dict):
+    """
+    A JSON page whose records array, page[data_key], is an iterator decoding
+    the records as the body arrives. chunks yields the body as bytes, close()
+    is called once the body is read or abandoned. size counts the bytes read
+    so far.
+    """
+    def __init__(self, chunks, data_key, close=None):
+        super().__init__()
+        self.chunks = iter(chunks)
+        self.data_key = data_key
+        self.close = close
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.started = False
+        self.done = False
+        self.size = 0
+        self.callbacks = []
+
+        self.skip()
+        self.expect("{")
+        if self.members(True):
+            self[data_key] = self.records()
+        else:
+            self[data_key] = []
+            self.finish()
+
+    def __missing__(self, key):
+        # A member after the records array, only known once they are read
+        if self.done:
+            raise KeyError(key)
+        if self.started:
+            raise RuntimeError("{} of a streamed page was read while its records were still being read".format(key))
+
+        self[self.data_key] = list(self[self.data_key])
+        return self[key]
+
+    def when_read(self, callback):
+        """Call callback() once the body is read or abandoned, now if it already is"""
+        if self.done:
+            callback()
+        else:
+            self.callbacks.append(callback)
+
+    def records(self):
+        """Decode the items of the records array, then the members after it"""
+        self.started = True
+        try:
+            first = True
+            while self.skip() != "]":
+                if not first:
+                    self.expect(",")
+                    self.skip()
+                first = False
+                yield self.value()
+
+            self.pos += 1
+            self.members(False)
+        finally:
+            self.finish()
+
+    def members(self, first):
+        """Decode members into the page, until the records array opens (True) or the object ends (False)"""
+        while self.skip() != "}":
+            if not first:
+                self.expect(",")
+                self.skip()
+            first = False
+
+            key = self.value()
+            self.skip()
+            self.expect(":")
+            if key == self.data_key and self.skip() == "[":
+                self.pos += 1
+                return True
+
+            self.skip()
+            self[key] = self.value()
+
+        self.pos += 1
+        return False
+
+    def value(self):
+        """Decode the JSON value at the current position, reading more of the body until it is complete"""
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill(len(self.buffer) - self.pos):
+                    raise
+                continue
+
+            if end < len(self.buffer) and self.buffer[end] not in NUMBER_CONTINUATIONS:
+                self.pos = end
+                return value
+
+            # A number or literal ending the buffer may go on in the next
+            # chunk, and so may a number cut after its "." or exponent, which
+            # raw_decode reads without them ("-12." as -12)
+            start = self.pos
+            if not self.fill():
+                # fill() dropped the characters before start
+                self.pos = end - start
+                return value
+
+    def skip(self):
+        """Move past whitespace, return the next character or "" at the end of the body"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.buffer[self.pos:self.pos + 1] != char:
+            raise json.JSONDecodeError("Expecting '{}'".format(char), self.buffer, self.pos)
+        self.pos += 1
+
+    def fill(self, size=0):
+        """
+        Read at least size more characters of the body (at least one chunk),
+        dropping what was already decoded. False at the end of the body.
+        """
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        before = len(self.buffer)
+        while len(self.buffer) < before + max(size, 1) and not self.eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+                self.buffer += self.decoder.decode(b"", final=True)
+            else:
+                self.size += len(chunk)
+                self.buffer += self.decoder.decode(chunk)
+        return len(self.buffer) > before
+
+    def finish(self):
+        if not self.done:
+            self.done = True
+            self.buffer = ""
+            if self.close is not None:
+                self.close()
+            for callback in self.callbacks:
+                callback()
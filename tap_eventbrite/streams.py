@@ -0,0 +1,508 @@
+"""
+Syncing the records of one stream, shared by both engines and the sharded
+backfills: flattening the records and sending them into Stitch, following the
+pages of an endpoint with their checkpoints, and the sales reports.
+"""
+import datetime
+import itertools
+import time
+import singer
+
+from tap_eventbrite import dedup, output, telemetry
+from tap_eventbrite.pagination import iter_pages, next_token, DEFAULT_PREFETCH
+from tap_eventbrite.streaming import StreamedPage
+
+LOGGER = singer.get_logger()
+
+# Every stream of the tap, in the order they are synced: events first, since
+# sales_reports needs the event ids
+STREAMS = {
+    'events': {'key_properties': ['id'], 'replication_keys': ['id']},
+    'sales_reports': {'key_properties': ['event_id', 'date'], 'replication_keys': ['event_id', 'date']},
+    'attendees': {'key_properties': ['id'], 'replication_keys': ['id']},
+    'orders': {'key_properties': ['id'], 'replication_keys': ['id']},
+    'categories': {'key_properties': ['id'], 'replication_keys': ['id']},
+    'subcategories': {'key_properties': ['id'], 'replication_keys': ['id']},
+}
+
+EVENTS = {} # EventIndex of every organization, used for sales reports table!
+
+DEFAULT_CHECKPOINT_EVERY_PAGES = 10
+
+# Records flattened and written together. With STREAM_JSON, a page's records
+# are held in memory one small batch at a time, well under a default page of 50
+RECORD_BATCH_SIZE = 100
+STREAMED_RECORD_BATCH_SIZE = 10
+
+def sync_stitch_data(records, data_key, stream_schema, stream_id, window_start = None, events=None, compiled_schema=None, org_id=None, batch_size=RECORD_BATCH_SIZE):
+    """
+    Basiclly, this function will send the data into Stitch by this line of code:
+    singer.write_record(stream_id, record)
+    Keyword arguments:
+    stream_id -- table name
+    record -- a single data in JSON format
+
+    Then, the Stitch will replicate the data into Google Big Query (GBQ). 
+    We already have the configuration in Stitch that created a pipeline-
+    into GBQ and the method is append.
+
+    window_start -- in RUN_DAILY mode, records neither created nor changed
+    since this UTC timestamp are skipped
+    org_id -- the organization the records are tagged with
+    batch_size -- records flattened and written together, see record_batch_size
+    """
+    count = 0
+    if compiled_schema is None:
+        compiled_schema = compile_schema(stream_schema)
+
+    parse_seconds = 0.0
+    filter_seconds = 0.0
+    write_seconds = 0.0
+    clock = time.perf_counter
+
+    skipped = 0
+    unchanged = 0
+
+    # records[data_key] may be a StreamedPage's iterator, only one batch of it is held at a time
+    for page in batches(records[data_key], batch_size):
+        if stream_id == "events":
+            """
+            For the events table (stream_id == "events"), we need to collect the-
+            event ids and their start/end dates, including the events outside of-
+            the RUN_DAILY window.
+            That will be served for the sale reports table. Sale reports will-
+            based on those event ids to retrieve the report for each event. 
+            """
+            for record in page:
+                events.add(record)
+
+        if window_start is not None:
+            started = clock()
+            page, outside = filter_window(page, window_start)
+            skipped += outside
+            filter_seconds += clock() - started
+
+        flattened = []
+        for record in page:
+
+            # parse_date: Correct the DateTime format
+            started = clock()
+            record = parse_date(stream_schema, record, compiled_schema)
+            parse_seconds += clock() - started
+
+            if org_id is not None:
+                record["org_id"] = org_id
+
+            flattened.append(record)
+
+        # The store is read outside the output lock, so streams do not wait on each other's lookups
+        store = dedup.STORE['store']
+        if store is not None:
+            fingerprints = store.lookup(stream_id, STREAMS[stream_id]['key_properties'], flattened)
+
+        # Held for the whole batch, so no STATE commits the fingerprints of records not written yet
+        with output.LOCK:
+            emitted = flattened
+            if store is not None:
+                emitted = store.changed(stream_id, fingerprints)
+                unchanged += len(flattened) - len(emitted)
+
+            # Send the data into Stitch!
+            for record in emitted:
+                started = clock()
+                output.write_record(stream_id, record)
+                write_seconds += clock() - started
+                count += 1    
+
+    telemetry.get(stream_id, org_id).add(records=count, records_skipped=skipped, records_unchanged=unchanged,
+                                 parse_seconds=parse_seconds, filter_seconds=filter_seconds, write_seconds=write_seconds)
+
+    # Return number of records had been sent into Stitch
+    return count
+
+class PageWriter():
+    """
+    Writes the pages of one paginated stream into Stitch and keeps its page
+    checkpoint in the state. The thread and async engines share it and only
+    differ in how the pages are fetched:
+
+        continue_token = writer.start()
+        while continue_token is not None:
+            page = fetch(continue_token)
+            if writer.refused(page):
+                continue_token = ""
+            else:
+                continue_token = writer.write(page)
+        count = writer.finish()
+
+    With checkpoint_every, the next continuation token, the records emitted so
+    far and the changed_since of the query are saved to the state every
+    checkpoint_every pages, so a crashed run restarts from the saved page.
+    With track_changed, the highest `changed` is bookmarked once the stream is
+    complete. With window_start, records outside the RUN_DAILY window are
+    skipped before they are flattened. With org_id, records are tagged with it.
+    """
+    def __init__(self, state, stream_id, data_key, stream_schema, compiled_schema, checkpoint_every=0, changed_since=None, track_changed=False, window_start=None, events=None, org_id=None):
+        self.state = state
+        self.stream_id = stream_id
+        self.data_key = data_key
+        self.stream_schema = stream_schema
+        self.compiled_schema = compiled_schema
+        self.checkpoint_every = checkpoint_every
+        self.changed_since = changed_since
+        self.track_changed = track_changed
+        self.window_start = window_start
+        self.events = events
+        self.org_id = org_id
+        self.count = 0
+        self.pages = 0
+        self.max_changed = singer.get_bookmark(state, stream_id, 'changed') if track_changed else None
+        self.resume_token = None
+
+    def start(self):
+        """The continuation token of the first page to fetch"""
+        if self.checkpoint_every:
+            self.resume_token = singer.get_bookmark(self.state, self.stream_id, 'continuation')
+
+        if not self.resume_token:
+            return ""
+
+        self.count = singer.get_bookmark(self.state, self.stream_id, 'records_emitted', 0)
+        self.max_changed = singer.get_bookmark(self.state, self.stream_id, 'pending_changed', self.max_changed)
+        LOGGER.info("{}: resuming from the saved page, {} record(s) already loaded".format(self.stream_id, self.count))
+        return self.resume_token
+
+    def refused(self, records):
+        """True when the API refused the saved continuation, the stream then starts from the first page"""
+        if records is None and self.pages == 0 and self.resume_token:
+            LOGGER.info("{}: the saved continuation was refused, starting from the first page".format(self.stream_id))
+            self.resume_token = None
+            self.count = 0
+            return True
+        return False
+
+    def write(self, records):
+        """Send one page into Stitch, return the continuation token of the next page or None"""
+        check_response(records, self.stream_id)
+        self.pages += 1
+        telemetry.get(self.stream_id, self.org_id).add(pages=1)
+
+        received = [0]
+        def read(page):
+            # The records as they are parsed, a streamed page can only be read once
+            for record in page:
+                received[0] += 1
+                if self.track_changed:
+                    self.max_changed = max_bookmark([record], 'changed', self.max_changed)
+                yield record
+
+        self.count += sync_stitch_data({self.data_key: read(records[self.data_key])}, self.data_key, self.stream_schema, self.stream_id, self.window_start, self.events,
+                                       compiled_schema=self.compiled_schema, org_id=self.org_id, batch_size=record_batch_size(records))
+        if received[0] == 0:
+            LOGGER.info("{}: There is no data to stream".format(self.stream_id))
+
+        # The stream ends on the page without a continuation
+        continue_token = next_token(records)
+
+        if continue_token is not None and self.checkpoint_every and self.pages % self.checkpoint_every == 0:
+            output.write_bookmark(self.state, self.stream_id, 'continuation', continue_token)
+            output.write_bookmark(self.state, self.stream_id, 'records_emitted', self.count)
+            output.write_bookmark(self.state, self.stream_id, 'changed_since', self.changed_since)
+            if self.track_changed:
+                output.write_bookmark(self.state, self.stream_id, 'pending_changed', self.max_changed)
+            output.write_state(self.state)
+
+        return continue_token
+
+    def finish(self):
+        """Drop the page checkpoint and move the bookmark forward, return the number of records"""
+        if self.checkpoint_every:
+            for key in ('continuation', 'records_emitted', 'changed_since', 'pending_changed'):
+                output.clear_bookmark(self.state, self.stream_id, key)
+
+        if self.track_changed:
+            # Without any changed record, the next run still starts where this one did, not yesterday
+            changed = self.max_changed if self.max_changed is not None else self.changed_since
+            if changed is not None:
+                output.write_bookmark(self.state, self.stream_id, 'changed', changed)
+
+        return self.count
+
+def sync_paginated(state, stream_id, data_key, stream_schema, compiled_schema, fetch, checkpoint_every=0, changed_since=None, track_changed=False, window_start=None, events=None, prefetch=DEFAULT_PREFETCH, org_id=None):
+    """
+    Follow the continuation tokens of a paginated endpoint and send every page
+    into Stitch. fetch(continue_token) returns one page, and up to prefetch
+    pages are downloaded ahead of the one being written.
+    See PageWriter for checkpoint_every, changed_since, track_changed,
+    window_start and org_id.
+    """
+    writer = PageWriter(state, stream_id, data_key, stream_schema, compiled_schema, checkpoint_every, changed_since, track_changed, window_start, events, org_id)
+    return write_pages(writer, fetch, prefetch)
+
+def write_pages(writer, fetch, prefetch=DEFAULT_PREFETCH):
+    """
+    Write the pages of fetch with writer, a PageWriter or a writer with the
+    same methods, until writer.write() returns None. Return the number of
+    records sent into Stitch.
+    """
+    continue_token = writer.start()
+
+    while continue_token is not None:
+        restart = False
+
+        # The next page is downloaded while this one is flattened and written
+        for records in iter_pages(fetch, continue_token, prefetch):
+            if writer.refused(records):
+                continue_token = ""
+                restart = True
+                break
+            if writer.write(records) is None:
+                break
+
+        if not restart:
+            continue_token = None
+
+    return writer.finish()
+
+class SalesReportWriter():
+    """
+    Plans the sales report requests of a run and writes their rows into
+    Stitch, keeping the last report day of every event in the state. Shared by
+    the thread and async engines, which only differ in how reports are fetched.
+    events is the EventIndex of the organization, org_id tags the rows.
+
+    Events that ended before the start of yesterday have their full report
+    once the run is over, so their days are dropped from the state and the
+    'ended_before' bookmark keeps them from being reported again.
+    """
+    def __init__(self, state, stream_schema, compiled_schema, batch_size, loading_new_data, events, org_id=None):
+        self.state = state
+        self.stream_schema = stream_schema
+        self.compiled_schema = compiled_schema
+        self.org_id = org_id
+        self.events = events
+        self.event_dates = dict(singer.get_bookmark(state, "sales_reports", 'event_dates', {}))
+        self.ended_before = singer.get_bookmark(state, "sales_reports", 'ended_before')
+        self.failed = False
+        self.threshold = get_threshold_time_formatted() if loading_new_data else None
+        self.count = 0
+
+        event_ids = events.selling_since(self.window_start)
+        LOGGER.info("Making loop for sales_reports. Times: {}, skipped {} event(s) that ended before the sync window!".format(len(event_ids), len(events) - len(event_ids)))
+        self.batches = [event_ids[i:i + batch_size] for i in range(0, len(event_ids), batch_size)]
+
+    def window_start(self, event_id):
+        # The event's last report day, or where the last complete run left off,
+        # so the days of missed runs are reported, or yesterday on a first
+        # RUN_DAILY run, or everything
+        return self.event_dates.get(event_id, self.ended_before or self.threshold)
+
+    def start_date(self, event_ids):
+        """
+        Restart from the oldest bookmarked day of the batch. On a RUN_DAILY run an
+        event without a bookmark starts where the last complete run left off, or
+        yesterday, otherwise it gets everything.
+        """
+        default = (self.ended_before or self.threshold) if self.threshold else None
+        bookmarks = [self.event_dates.get(event_id, default) for event_id in event_ids]
+        return None if None in bookmarks else min(bookmarks)[:10]
+
+    def write(self, event_ids, records):
+        """Send the report of one batch of events into Stitch"""
+        from tap_eventbrite.sales_report import split_sales_report
+
+        stream_id = "sales_reports"
+        telemetry.get(stream_id, self.org_id).add(pages=1)
+        if records is None:
+            self.failed = True
+        bookmarks = {event_id: self.event_dates.get(event_id, "") for event_id in event_ids}
+
+        received = [0]
+        def read():
+            for row in split_sales_report(records, event_ids):
+                # The last bookmarked day is fetched again, it may have been partial
+                if row.get('date') is None or row['date'] >= bookmarks.get(row['event_id'], ""):
+                    received[0] += 1
+                    if row.get('date') is not None:
+                        self.event_dates[row['event_id']] = max(row['date'], self.event_dates.get(row['event_id'], ""))
+                    yield row
+
+        self.count += sync_stitch_data({'data': read()}, 'data', self.stream_schema, stream_id, compiled_schema=self.compiled_schema, org_id=self.org_id,
+                                       batch_size=record_batch_size(records))
+        if received[0] == 0:
+            LOGGER.info("{}: There is no data to stream".format(stream_id))
+
+    def finish(self):
+        """Bookmark the last report day of every event still selling, return the number of records"""
+        # A report that failed must be fetched again, ended or not
+        if len(self.events) > 0 and not self.failed:
+            ended_before = get_threshold_time_formatted()
+            for event_id in list(self.event_dates):
+                end_utc = self.events.end_utc(event_id)
+                # Ended before yesterday, or no longer listed by the events API
+                if event_id not in self.events or (end_utc and end_utc < ended_before):
+                    del self.event_dates[event_id]
+            output.write_bookmark(self.state, "sales_reports", 'ended_before', max(ended_before, self.ended_before or ""))
+
+        output.write_bookmark(self.state, "sales_reports", 'event_dates', self.event_dates)
+        return self.count
+
+def start_stream(stream, org_id=None):
+    """Write the stream's SCHEMA message and start its clock, return its compiled schema"""
+    stream_id = stream['tap_stream_id']
+
+    # Write schema table 
+    output.write_schema(stream_id, stream['schema'], stream['key_properties'])
+    telemetry.start(stream_id, org_id)
+    return compile_schema(stream['schema'])
+
+def finish_stream(state, stream_id, count, org_id=None):
+    output.write_state(state)
+    LOGGER.info('Syncing stream:' + stream_id)
+    LOGGER.info("\033[92mFor {}: loaded {} record(s) into Stitch!\033[0m".format(stream_id, count))
+    telemetry.finish(stream_id, org_id)
+
+def get_events(org_id):
+    """The EventIndex of an organization, created on first use"""
+    from tap_eventbrite.event import EventIndex
+    return EVENTS.setdefault(org_id, EventIndex())
+
+def record_batch_size(page):
+    """Records of the page flattened and written together: a small batch of a streamed page"""
+    return STREAMED_RECORD_BATCH_SIZE if isinstance(page, StreamedPage) else RECORD_BATCH_SIZE
+
+def batches(records, size):
+    """Lists of up to size records, from any iterable"""
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+def check_response(records, stream_id):
+    """Stop the sync when a page could not be fetched instead of losing the rest of it"""
+    if records is None:
+        from tap_eventbrite import client
+        raise client.EventbriteError("{}: the API call failed, stopping the sync".format(stream_id))
+
+def get_changed_since(state, stream_id, loading_new_data, backfill_start=None):
+    """
+    Start of the changed_since window: the stream's bookmark when there is one,
+    yesterday for a first RUN_DAILY run, or backfill_start (None: the
+    endpoint's default) for a full load.
+    A run resuming from a page checkpoint keeps the window it was started with.
+    """
+    if singer.get_bookmark(state, stream_id, 'continuation'):
+        return singer.get_bookmark(state, stream_id, 'changed_since')
+
+    changed_since = singer.get_bookmark(state, stream_id, 'changed')
+
+    if changed_since is None and loading_new_data:
+        changed_since = get_threshold_time_formatted()
+
+    if changed_since is None:
+        changed_since = backfill_start
+
+    return changed_since
+
+def max_bookmark(records, key, current):
+    """Highest value of key in the records, ISO 8601 strings compare in time order"""
+    for record in records:
+        value = record.get(key)
+        if value is not None and (current is None or value > current):
+            current = value
+    return current
+
+def get_threshold_time_formatted():
+    """Start of yesterday in UTC, the window of a RUN_DAILY run"""
+    now =  datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)
+    formatted_date = now.strftime("%Y-%m-%dT00:00:00Z")
+    return formatted_date
+
+DEFAULT_DATE_TIME = "1971-01-01T00:00:00Z"
+
+def compile_schema(schema):
+    """
+    Compile a stream schema into a list of flattening rules, once per stream.
+    Each rule is (schema_key, path, is_date_time, default), where path is the
+    dotted schema key already split into a tuple and default is the value used
+    when the field is missing from the record.
+    """
+    compiled = []
+    for schema_key, schema_key_properties in schema['properties'].items():
+        is_date_time = schema_key_properties.get('format') is not None
+
+        if is_date_time:
+            default = DEFAULT_DATE_TIME
+        elif schema_key_properties['type'][1] == "integer":
+            default = 0
+        else:
+            default = ""
+
+        compiled.append((schema_key, tuple(schema_key.split(".")), is_date_time, default))
+
+    return compiled
+
+def get_expansions(schema, available):
+    """
+    Expansions to request so the nested objects of the schema come back filled
+    in: every first part of a dotted schema key that the endpoint can expand.
+    """
+    expand = []
+    for schema_key in schema['properties']:
+        if "." in schema_key:
+            parent = schema_key.split(".")[0]
+            if parent in available and parent not in expand:
+                expand.append(parent)
+    return expand
+
+def filter_window(records, window_start):
+    """
+    Split a page of records into the ones created or changed at or after
+    window_start, and the number of the others.
+    Eventbrite timestamps are UTC ISO 8601 strings ("2020-01-01T00:00:00Z"),
+    so they are compared as strings, without parsing. A record with only
+    one of the two timestamps is judged on that one, a record with neither
+    is kept. The window has no end: records changed after it started, up to
+    now, are all kept.
+    """
+    start = window_start[:19]
+    kept = []
+    for record in records:
+        created = record.get('created')
+        changed = record.get('changed')
+        if type(created) is not str:
+            created = None
+        if type(changed) is not str:
+            changed = None
+        if (created is None and changed is None) or (changed is not None and changed[:19] >= start) \
+                or (created is not None and created[:19] >= start):
+            kept.append(record)
+    return kept, len(records) - len(kept)
+
+def parse_date(schema, record, compiled_schema = None):
+    """Correcting the data before sending it to Google Bigquery"""
+    if compiled_schema is None:
+        compiled_schema = compile_schema(schema)
+
+    result = {}
+    for schema_key, path, is_date_time, default in compiled_schema:
+        data = record
+        for key in path:
+            if isinstance(data, dict) and key in data:
+                data = data[key]
+            else:
+                data = default
+                break
+        else:
+            if is_date_time:
+                """Dates without a timezone are UTC, anything that is not a string is missing"""
+                if type(data) is not str:
+                    data = default
+                elif "Z" not in data:
+                    data = data + "Z"
+
+        result[schema_key] = data
+
+    return result
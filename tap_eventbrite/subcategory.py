@@ -1,25 +1,33 @@
-import requests
 import time
 import os
 import singer
 import json  
 
+from tap_eventbrite import client
+
 LOGGER = singer.get_logger() 
 
-def subcategories_call(token, org, continue_token):
+def subcategories_url(org, continue_token, page_size=None):
     url = "https://www.eventbriteapi.com/v3/subcategories/"
+    params = []
 
     if len(continue_token) > 0:
-        url = url + "?continuation={}".format(continue_token)
-        
-    headers = {
-        'authorization': "Bearer {}".format(token)
-    }
+        params.append("continuation={}".format(continue_token))
+
+    if page_size:
+        params.append("page_size={}".format(page_size))
+
+    if params:
+        url = url + "?" + "&".join(params)
+
+    return url
 
-    response = requests.request("GET", url, headers=headers)
+def subcategories_call(token, org, continue_token, page_size=None):
+    url = subcategories_url(org, continue_token, page_size)
+    response = client.get(url, token, "subcategories")
 
     if response.status_code == 200:
-        attendees_json = response.json()
+        attendees_json = client.page(response, "subcategories", "subcategories")
         return attendees_json
 
     else:
@@ -0,0 +1,177 @@
+import contextlib
+import json
+import threading
+import time
+import singer
+
+from singer.metrics import Point
+
+LOGGER = singer.get_logger()
+
+# Upper bounds of the HTTP latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = [50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+class StreamMetrics():
+    """Counters for one stream of one organization, updated from any thread"""
+    def __init__(self, stream_id, org_id=None):
+        self.stream_id = stream_id
+        self.org_id = org_id
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.finished = None
+        self.http_requests = 0
+        self.http_latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.http_seconds = 0.0
+        self.bytes_downloaded = 0
+        self.pages = 0
+        self.records = 0
+        self.records_skipped = 0
+        self.records_unchanged = 0
+        self.parse_seconds = 0.0
+        self.filter_seconds = 0.0
+        self.write_seconds = 0.0
+        self.throttle_seconds = 0.0
+        self.cache_hits = 0
+
+    def add_request(self, seconds, size):
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and seconds * 1000 > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+
+        with self.lock:
+            self.http_requests += 1
+            self.http_latency[bucket] += 1
+            self.http_seconds += seconds
+            self.bytes_downloaded += size
+
+    def add(self, **values):
+        with self.lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def summary(self):
+        with self.lock:
+            elapsed = (self.finished or time.monotonic()) - self.started
+            histogram = {}
+            for bound, count in zip(LATENCY_BUCKETS + ["inf"], self.http_latency):
+                histogram["le_{}ms".format(bound) if bound != "inf" else "le_inf"] = count
+
+            summary = {
+                'stream': self.stream_id,
+                'wall_seconds': round(elapsed, 3),
+                'records': self.records,
+                'records_skipped': self.records_skipped,
+                'records_unchanged': self.records_unchanged,
+                'records_per_second': round(self.records / elapsed, 1) if elapsed > 0 else 0,
+                'pages': self.pages,
+                'http_requests': self.http_requests,
+                'cache_hits': self.cache_hits,
+                'http_seconds': round(self.http_seconds, 3),
+                'http_latency_histogram': histogram,
+                'bytes_downloaded': self.bytes_downloaded,
+                'parse_date_seconds': round(self.parse_seconds, 3),
+                'window_filter_seconds': round(self.filter_seconds, 3),
+                'write_record_seconds': round(self.write_seconds, 3),
+                'throttle_seconds': round(self.throttle_seconds, 3),
+            }
+            if self.org_id is not None:
+                summary['org_id'] = self.org_id
+            return summary
+
+METRICS = {}
+METRICS_LOCK = threading.Lock()
+
+def reset():
+    with METRICS_LOCK:
+        METRICS.clear()
+
+def get(stream_id, org_id=None):
+    """
+    Metrics of a stream of an organization, created on first use. stream_id
+    None is counted as 'other', org_id None for streams of no organization
+    (categories, subcategories).
+    """
+    stream_id = stream_id or "other"
+    with METRICS_LOCK:
+        metrics = METRICS.get((org_id, stream_id))
+        if metrics is None:
+            metrics = METRICS[(org_id, stream_id)] = StreamMetrics(stream_id, org_id)
+        return metrics
+
+def start(stream_id, org_id=None):
+    """Start the stream's clock"""
+    metrics = get(stream_id, org_id)
+    with metrics.lock:
+        metrics.started = time.monotonic()
+        metrics.finished = None
+
+def finish(stream_id, org_id=None):
+    """Stop the stream's clock and log its metrics as Singer METRIC lines"""
+    metrics = get(stream_id, org_id)
+    with metrics.lock:
+        metrics.finished = time.monotonic()
+
+    summary = metrics.summary()
+    tags = {'endpoint': summary['stream']}
+    if org_id is not None:
+        tags['org_id'] = org_id
+    singer.metrics.log(LOGGER, Point('counter', 'record_count', summary['records'], tags))
+    singer.metrics.log(LOGGER, Point('counter', 'records_skipped', summary['records_skipped'], tags))
+    singer.metrics.log(LOGGER, Point('counter', 'records_unchanged', summary['records_unchanged'], tags))
+    singer.metrics.log(LOGGER, Point('counter', 'page_count', summary['pages'], tags))
+    singer.metrics.log(LOGGER, Point('counter', 'http_request_count', summary['http_requests'], tags))
+    singer.metrics.log(LOGGER, Point('counter', 'cache_hits', summary['cache_hits'], tags))
+    singer.metrics.log(LOGGER, Point('counter', 'bytes_downloaded', summary['bytes_downloaded'], tags))
+    singer.metrics.log(LOGGER, Point('histogram', 'http_request_duration', summary['http_latency_histogram'], tags))
+    singer.metrics.log(LOGGER, Point('timer', 'http_duration', summary['http_seconds'], tags))
+    singer.metrics.log(LOGGER, Point('timer', 'parse_date_duration', summary['parse_date_seconds'], tags))
+    singer.metrics.log(LOGGER, Point('timer', 'window_filter_duration', summary['window_filter_seconds'], tags))
+    singer.metrics.log(LOGGER, Point('timer', 'write_record_duration', summary['write_record_seconds'], tags))
+    singer.metrics.log(LOGGER, Point('timer', 'throttle_duration', summary['throttle_seconds'], tags))
+    singer.metrics.log(LOGGER, Point('gauge', 'records_per_second', summary['records_per_second'], tags))
+
+def write_summary(path):
+    """Write the metrics of every stream of every organization into a JSON file"""
+    with METRICS_LOCK:
+        streams = [metrics.summary() for metrics in METRICS.values()]
+
+    with open(path, 'w') as file:
+        json.dump({'streams': streams}, file, indent=2)
+
+@contextlib.contextmanager
+def profile(config):
+    """
+    Profile the block when PROFILE is "cprofile" or "pyinstrument", writing the
+    result to PROFILE_OUTPUT. Both profilers only see the calling thread, so
+    streams synced on a thread pool (STREAM_CONCURRENCY above 1 with the
+    threads engine) are refused.
+    """
+    profiler_name = config.get('PROFILE')
+
+    if not profiler_name:
+        yield
+        return
+
+    if int(config.get('STREAM_CONCURRENCY', 1)) > 1 and config.get('ENGINE', "threads") != "async":
+        raise Exception("PROFILE only sees the main thread, set STREAM_CONCURRENCY to 1 or ENGINE to async to profile the sync")
+
+    if profiler_name == "pyinstrument":
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(config.get('PROFILE_OUTPUT', 'tap_eventbrite_profile.html'), 'w') as file:
+                file.write(profiler.output_html())
+        return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(config.get('PROFILE_OUTPUT', 'tap_eventbrite.prof'))
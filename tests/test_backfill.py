@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from tap_eventbrite import backfill, load_schemas, compile_schema
+from tap_eventbrite.client import EventbriteError
+
+def test_windows_cover_the_backfill_without_gaps():
+    shards = backfill.plan_shards("2020-01-01T00:00:00Z", "2020-01-04T00:00:00Z", 3)
+    assert [(shard['from'], shard['to']) for shard in shards] == [
+        ("2020-01-01T00:00:00Z", "2020-01-02T00:00:00Z"),
+        ("2020-01-02T00:00:00Z", "2020-01-03T00:00:00Z"),
+        ("2020-01-03T00:00:00Z", "2020-01-04T00:00:00Z"),
+    ]
+    assert all(shard['continuation'] == "" and not shard['done'] for shard in shards)
+
+def test_never_more_windows_than_seconds():
+    assert len(backfill.plan_shards("2020-01-01T00:00:00Z", "2020-01-01T00:00:02Z", 5)) == 2
+
+def make_writer(shard, first=False):
+    schema = load_schemas()['attendees']
+    state = {'bookmarks': {'attendees': {'backfill': {'shards': [shard]}}}}
+    return backfill.ShardWriter(state, 'attendees', 'attendees', schema, compile_schema(schema), shard, first)
+
+def page(changed, continuation=None):
+    pagination = {'continuation': continuation} if continuation else {}
+    return {'attendees': [{'id': str(index), 'changed': value} for index, value in enumerate(changed)], 'pagination': pagination}
+
+def emitted(capsys):
+    return [json.loads(line)['record']['id'] for line in capsys.readouterr().out.splitlines() if '"RECORD"' in line]
+
+def test_shard_keeps_its_window_and_stops_past_it(capsys):
+    shard = {'from': "2020-01-02T00:00:00Z", 'to': "2020-01-03T00:00:00Z", 'continuation': "", 'done': False}
+    writer = make_writer(shard)
+
+    assert writer.write(page(["2020-01-01T23:59:59Z", "2020-01-02T00:00:00Z", "2020-01-03T00:00:00Z"], "next")) == "next"
+    assert emitted(capsys) == ["1"]
+    assert shard['continuation'] == "next"
+
+    assert writer.write(page(["2020-01-03T00:00:00Z", "2020-01-05T00:00:00Z"], "more")) is None
+    assert emitted(capsys) == []
+    assert shard['done']
+
+def test_records_without_a_changed_date_go_to_the_first_shard(capsys):
+    first = make_writer({'from': "2020-01-01T00:00:00Z", 'to': "2020-01-02T00:00:00Z", 'continuation': "", 'done': False}, first=True)
+    second = make_writer({'from': "2020-01-02T00:00:00Z", 'to': "2020-01-03T00:00:00Z", 'continuation': "", 'done': False})
+
+    first.write({'attendees': [{'id': "a", 'changed': "2020-01-01T10:00:00Z"}, {'id': "b"}], 'pagination': {}})
+    second.write({'attendees': [{'id': "c"}, {'id': "d", 'changed': "2020-01-02T10:00:00Z"}], 'pagination': {}})
+    assert emitted(capsys) == ["a", "b", "d"]
+
+def test_records_out_of_change_order_stop_the_sync(capsys):
+    shard = {'from': "2020-01-01T00:00:00Z", 'to': "2020-01-03T00:00:00Z", 'continuation': "", 'done': False}
+    writer = make_writer(shard)
+    writer.write(page(["2020-01-01T10:00:00Z", "2020-01-01T10:00:00Z", "2020-01-02T10:00:00Z"], "next"))
+
+    with pytest.raises(EventbriteError, match="oldest change first"):
+        writer.write(page(["2020-01-02T09:00:00Z"], "more"))
+    assert shard['continuation'] == "next"
+    assert not shard['done']
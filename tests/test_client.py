@@ -0,0 +1,162 @@
+import os
+
+import pytest
+import requests
+
+from requests.adapters import BaseAdapter
+
+from tap_eventbrite import cache, client, ratelimit, telemetry
+from tap_eventbrite.cache import ResponseCache
+
+URL = "https://www.eventbriteapi.com/v3/categories/?page_size=50"
+
+class Clock():
+    """The time module of client, ratelimit and cache, without waiting"""
+    def __init__(self):
+        self.now = 1000000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+class ScriptedAdapter(BaseAdapter):
+    """Answers every request with the next (status, headers, body), or raises it when it is an exception"""
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        answer = self.responses.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+
+        status, headers, body = answer
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = body.encode('utf-8')
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(client, "time", clock)
+    monkeypatch.setattr(ratelimit, "time", clock)
+    monkeypatch.setattr(cache, "time", clock)
+    # No jitter, so the backoff delays are known
+    monkeypatch.setattr(ratelimit.random, "uniform", lambda low, high: high)
+    return clock
+
+def configure(adapter, **config):
+    client.configure(dict({'HTTP_MAX_RETRIES': 3, 'HTTP_BACKOFF_FACTOR': 1, 'HTTP_BACKOFF_MAX': 60}, **config))
+    client.mount(adapter)
+
+@pytest.fixture(autouse=True)
+def unmount():
+    yield
+    client.mount(None)
+    client.configure({})
+
+def test_5xx_and_connection_errors_are_retried_with_backoff(clock):
+    adapter = ScriptedAdapter([(503, {}, ""), requests.ConnectionError("reset"), (200, {}, '{"categories": []}')])
+    configure(adapter)
+
+    response = client.fetch(URL, "token", "categories")
+    assert response.status_code == 200
+    assert len(adapter.requests) == 3
+    assert clock.slept == [1, 2]
+
+def test_a_429_pauses_the_token_for_its_retry_after(clock):
+    adapter = ScriptedAdapter([(429, {'Retry-After': "30"}, ""), (200, {}, "{}")])
+    configure(adapter)
+
+    assert client.fetch(URL, "token", "categories").status_code == 200
+    # Waited by the rate limiter, for every caller of the token
+    assert clock.slept == [30]
+
+def test_other_errors_are_returned_without_retrying(clock):
+    adapter = ScriptedAdapter([(404, {}, "{}")])
+    configure(adapter)
+
+    assert client.fetch(URL, "token", "categories").status_code == 404
+    assert clock.slept == []
+
+def test_the_last_failure_raises_an_eventbrite_error(clock):
+    adapter = ScriptedAdapter([(500, {}, "")] * 4)
+    configure(adapter)
+
+    with pytest.raises(client.EventbriteError, match="HTTP 500 for .*categories/ after 3 retries"):
+        client.fetch(URL, "token", "categories")
+    assert len(adapter.requests) == 4
+    assert clock.slept == [1, 2, 4]
+
+def test_a_cached_page_is_used_without_a_request_until_its_ttl(clock, tmp_path):
+    adapter = ScriptedAdapter([(200, {}, '{"categories": [1]}'), (200, {}, '{"categories": [2]}')])
+    configure(adapter, HTTP_CACHE_DIR=str(tmp_path), HTTP_CACHE_TTL={'categories': 100})
+    telemetry.reset()
+
+    assert client.get(URL, "token", "categories").json() == {'categories': [1]}
+    clock.now += 99
+    assert client.get(URL, "token", "categories").json() == {'categories': [1]}
+    assert len(adapter.requests) == 1
+    assert telemetry.get("categories").cache_hits == 1
+
+    clock.now += 1
+    assert client.get(URL, "token", "categories").json() == {'categories': [2]}
+    assert len(adapter.requests) == 2
+    # Cached per token
+    adapter.responses.append((200, {}, '{"categories": [3]}'))
+    assert client.get(URL, "other", "categories").json() == {'categories': [3]}
+
+def test_a_stale_page_is_revalidated_and_reused_on_a_304(clock, tmp_path):
+    modified = "Wed, 01 Jan 2020 00:00:00 GMT"
+    adapter = ScriptedAdapter([(200, {'ETag': '"v1"', 'Last-Modified': modified}, '{"events": [1]}'), (304, {}, "")])
+    configure(adapter, HTTP_CACHE_DIR=str(tmp_path))
+    telemetry.reset()
+
+    # events have a TTL of 0: every call asks the API
+    assert client.get(URL, "token", "events").json() == {'events': [1]}
+    assert 'If-None-Match' not in adapter.requests[0].headers
+
+    response = client.get(URL, "token", "events")
+    assert response.status_code == 200
+    assert response.json() == {'events': [1]}
+    assert adapter.requests[1].headers['If-None-Match'] == '"v1"'
+    assert adapter.requests[1].headers['If-Modified-Since'] == modified
+    assert telemetry.get("events").cache_hits == 1
+
+def test_streams_without_a_ttl_are_not_cached(clock, tmp_path):
+    adapter = ScriptedAdapter([(200, {'ETag': '"v1"'}, "{}"), (200, {}, "{}")])
+    configure(adapter, HTTP_CACHE_DIR=str(tmp_path))
+
+    client.get(URL, "token", "attendees")
+    client.get(URL, "token", "attendees")
+    assert 'If-None-Match' not in adapter.requests[1].headers
+
+def test_the_least_recently_used_pages_are_evicted_first(tmp_path):
+    body = "x" * 1000
+    response_cache = ResponseCache(str(tmp_path), max_bytes=3500)
+    for index, name in enumerate(["a", "b", "c"]):
+        response_cache.put(name, "token", body)
+        os.utime(response_cache.path(name, "token"), (1000 + index, 1000 + index))
+
+    # A hit makes "a" the most recently used
+    assert response_cache.get("a", "token")['body'] == body
+    response_cache.put("d", "token", body)
+
+    # Down to 90% of max_bytes: the two least recently used go
+    assert [response_cache.get(name, "token") is not None for name in ["a", "b", "c", "d"]] == [True, False, False, True]
@@ -0,0 +1,31 @@
+from tap_eventbrite.dedup import FingerprintStore
+
+KEYS = ['id']
+
+def emit(store, records):
+    return store.changed("attendees", store.lookup("attendees", KEYS, records))
+
+def test_unchanged_records_are_not_emitted_again(tmp_path):
+    records = [{'id': "1", 'name': "a"}, {'id': "2", 'name': "b"}]
+    store = FingerprintStore(str(tmp_path / "fp.db"))
+    assert emit(store, records) == records
+    # Emitted earlier in this run
+    assert emit(store, records) == []
+    store.commit()
+    store.close()
+
+    store = FingerprintStore(str(tmp_path / "fp.db"))
+    assert emit(store, [{'id': "1", 'name': "a"}, {'id': "2", 'name': "changed"}]) == [{'id': "2", 'name': "changed"}]
+    store.close()
+
+def test_records_without_a_state_are_emitted_again(tmp_path):
+    store = FingerprintStore(str(tmp_path / "fp.db"))
+    emit(store, [{'id': "1"}])
+    store.commit()
+    # The run dies before the STATE covering this record
+    emit(store, [{'id': "2"}])
+    store.close()
+
+    store = FingerprintStore(str(tmp_path / "fp.db"))
+    assert emit(store, [{'id': "1"}, {'id': "2"}]) == [{'id': "2"}]
+    store.close()
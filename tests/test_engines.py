@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+import tap_eventbrite
+
+from benchmarks.fake_api import FakeEventbriteAdapter
+from tap_eventbrite import aio, client
+
+CONFIG = {'EVENTBRITE_TOKEN': "t", 'ORG_ID': "1", 'RUN_DAILY': False, 'HTTP_BACKOFF_FACTOR': 0.01}
+
+def run(capsys, **config):
+    adapter = FakeEventbriteAdapter(events=12, attendees=230, orders=120, categories=7, subcategories=30, report_days=4,
+                                    error_rate=0.1, seed=1)
+    client.mount(adapter)
+    try:
+        tap_eventbrite.sync(dict(CONFIG, **config), {}, tap_eventbrite.sort_catalog(tap_eventbrite.discover()))
+    finally:
+        client.mount(None)
+    return capsys.readouterr().out
+
+@pytest.mark.skipif(aio.aiohttp is None, reason="aiohttp is not installed")
+def test_the_async_engine_writes_the_same_output(capsys):
+    threads = run(capsys)
+    assert threads.count('"RECORD"') > 400
+    assert run(capsys, ENGINE="async") == threads
+
+@pytest.mark.skipif(aio.aiohttp is None, reason="aiohttp is not installed")
+def test_concurrent_engines_write_the_same_records(capsys):
+    def records(output):
+        return sorted(line for line in output.splitlines() if '"RECORD"' in line)
+
+    def state(output):
+        return [json.loads(line) for line in output.splitlines() if '"STATE"' in line][-1]
+
+    threads = run(capsys, STREAM_CONCURRENCY=3, SALES_REPORTS_CONCURRENCY=3)
+    concurrent = run(capsys, ENGINE="async", STREAM_CONCURRENCY=3, SALES_REPORTS_CONCURRENCY=3, PAGE_PREFETCH=2)
+    assert records(concurrent) == records(threads)
+    assert state(concurrent) == state(threads)
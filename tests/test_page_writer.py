@@ -0,0 +1,95 @@
+import copy
+import json
+
+import pytest
+
+import tap_eventbrite
+
+PAGES = 10
+PAGE_SIZE = 5
+
+def make_writer(state, changed_since, checkpoint_every=0):
+    schema = tap_eventbrite.load_schemas()['attendees']
+    return tap_eventbrite.PageWriter(state, "attendees", 'attendees', schema, tap_eventbrite.compile_schema(schema),
+                                     checkpoint_every, changed_since, track_changed=True)
+
+def page(records, continuation=None):
+    pagination = {'has_more_items': continuation is not None}
+    if continuation is not None:
+        pagination['continuation'] = continuation
+    return {'attendees': records, 'pagination': pagination}
+
+def test_the_highest_changed_is_bookmarked(capsys):
+    state = {}
+    writer = make_writer(state, "2020-01-01T00:00:00Z")
+    tap_eventbrite.write_pages(writer, lambda continue_token: page([{'id': "1", 'changed': "2020-01-03T00:00:00Z"},
+                                                                    {'id': "2", 'changed': "2020-01-02T00:00:00Z"}]), 0)
+    assert state['bookmarks']['attendees']['changed'] == "2020-01-03T00:00:00Z"
+
+def test_a_run_without_records_bookmarks_its_window_start(capsys):
+    state = {}
+    writer = make_writer(state, "2020-01-01T00:00:00Z")
+    assert tap_eventbrite.write_pages(writer, lambda continue_token: page([]), 0) == 0
+    # The next daily run starts there, not at the start of its yesterday
+    assert state['bookmarks']['attendees']['changed'] == "2020-01-01T00:00:00Z"
+
+def changed(index):
+    return "2020-01-01T{:02d}:{:02d}:00Z".format(index // 60, index % 60)
+
+def api(calls, fail_at=None, refused=()):
+    """fetch() of PAGES pages, whose continuation tokens are the page numbers, the refused ones only the first time"""
+    def fetch(continue_token):
+        calls.append(continue_token)
+        if continue_token in refused and calls.count(continue_token) == 1:
+            # An expired token, the same page is served under a new one afterwards
+            return None
+        number = int(continue_token or 0)
+        if number == fail_at:
+            raise RuntimeError("the run dies")
+        records = [{'id': str(number * PAGE_SIZE + index), 'changed': changed(number * PAGE_SIZE + index)} for index in range(PAGE_SIZE)]
+        return page(records, str(number + 1) if number + 1 < PAGES else None)
+    return fetch
+
+def messages(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+def test_a_crashed_run_resumes_from_its_last_checkpoint(capsys):
+    state = {}
+    calls = []
+    with pytest.raises(RuntimeError):
+        tap_eventbrite.write_pages(make_writer(state, "2019-12-01T00:00:00Z", 3), api(calls, fail_at=7), 0)
+
+    first = messages(capsys)
+    first_ids = [message['record']['id'] for message in first if message['type'] == "RECORD"]
+    assert len(first_ids) == 7 * PAGE_SIZE
+    bookmark = [message for message in first if message['type'] == "STATE"][-1]['value']['bookmarks']['attendees']
+    assert bookmark == {'continuation': "6", 'records_emitted': 6 * PAGE_SIZE, 'changed_since': "2019-12-01T00:00:00Z",
+                        'pending_changed': changed(6 * PAGE_SIZE - 1)}
+
+    # The next run gets the last STATE back, and keeps the window it was started with
+    state = copy.deepcopy([message for message in first if message['type'] == "STATE"][-1]['value'])
+    changed_since = tap_eventbrite.get_changed_since(state, "attendees", True)
+    assert changed_since == "2019-12-01T00:00:00Z"
+
+    calls = []
+    count = tap_eventbrite.write_pages(make_writer(state, changed_since, 3), api(calls), 0)
+    assert calls[0] == "6"
+    assert count == PAGES * PAGE_SIZE
+
+    second_ids = [message['record']['id'] for message in messages(capsys) if message['type'] == "RECORD"]
+    assert sorted(set(first_ids) | set(second_ids), key=int) == [str(index) for index in range(PAGES * PAGE_SIZE)]
+    # Only the pages after the checkpoint are sent again
+    assert len(second_ids) == 4 * PAGE_SIZE
+    assert state['bookmarks']['attendees'] == {'changed': changed(PAGES * PAGE_SIZE - 1)}
+
+def test_a_refused_continuation_starts_the_stream_over(capsys):
+    state = {'bookmarks': {'attendees': {'continuation': "4", 'records_emitted': 20, 'changed_since': "2019-12-01T00:00:00Z",
+                                         'pending_changed': "2020-01-01T00:19:00Z"}}}
+    calls = []
+    count = tap_eventbrite.write_pages(make_writer(state, "2019-12-01T00:00:00Z", 3), api(calls, refused=("4",)), 0)
+
+    assert calls[:2] == ["4", ""]
+    assert count == PAGES * PAGE_SIZE
+    ids = [message['record']['id'] for message in messages(capsys) if message['type'] == "RECORD"]
+    assert ids == [str(index) for index in range(PAGES * PAGE_SIZE)]
+    assert state['bookmarks']['attendees'] == {'changed': changed(PAGES * PAGE_SIZE - 1)}
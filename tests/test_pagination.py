@@ -0,0 +1,122 @@
+import json
+import random
+import threading
+import time
+
+import pytest
+
+from tap_eventbrite.client import JsonPage
+from tap_eventbrite.pagination import PageSizer, iter_pages
+from tap_eventbrite.streaming import StreamedPage
+from tap_eventbrite.telemetry import StreamMetrics
+
+class RecordingSizer(PageSizer):
+    def __init__(self):
+        super().__init__(50, adaptive=True)
+        self.observed = []
+
+    def observe(self, seconds, size_bytes):
+        self.observed.append(size_bytes)
+
+def body(records, continuation=None):
+    return json.dumps({'pagination': {'continuation': continuation}, 'attendees': records}).encode()
+
+def test_every_page_is_measured_by_its_own_size():
+    sizer = RecordingSizer()
+    pages = {"": JsonPage({'attendees': []}, 1000), "2": JsonPage({'attendees': []}, 10)}
+    fetch = sizer.measured(pages.get, StreamMetrics("attendees"))
+
+    fetch("")
+    fetch("2")
+    assert sizer.observed == [1000, 10]
+
+def test_streamed_page_is_measured_once_its_body_is_read():
+    sizer = RecordingSizer()
+    content = body([{'id': str(index)} for index in range(100)])
+    chunks = [content[index:index + 100] for index in range(0, len(content), 100)]
+    fetch = sizer.measured(lambda continue_token: StreamedPage(chunks, 'attendees'), StreamMetrics("attendees"))
+
+    page = fetch("")
+    assert sizer.observed == []
+    assert len(list(page['attendees'])) == 100
+    assert sizer.observed == [len(content)]
+
+@pytest.mark.parametrize("cut", ['-12500.', '-12500.0', '1E', '1E+', '2.5e', '2.5e-', '7', 'tr', '3.'])
+def test_a_number_cut_by_a_chunk_is_decoded_whole(cut):
+    content = b'{"extra": -12500.05, "rate": 1E+2, "attendees": [2.5e-1, 7, true], "after": 3.5}'
+    # The first chunk ends after cut, inside the value it starts
+    split = content.index(cut.encode()) + len(cut)
+    page = StreamedPage([content[:split], content[split:]], 'attendees')
+    assert (page['extra'], page['rate']) == (-12500.05, 100.0)
+    assert list(page['attendees']) == [0.25, 7, True]
+    assert page['after'] == 3.5
+
+def test_any_chunking_decodes_the_same_page():
+    records = []
+    for index in range(30):
+        records += [{'id': str(index), 'name': "é{}".format(index)}, -12500.5 * index, 1.5e-7 * index]
+    content = json.dumps({'extra': -2.5e-9, 'attendees': records, 'pagination': {'has_more_items': False}}).encode()
+    generator = random.Random(1)
+    for attempt in range(200):
+        splits = sorted(generator.sample(range(1, len(content)), generator.randint(1, 40)))
+        chunks = [content[start:end] for start, end in zip([0] + splits, splits + [len(content)])]
+        page = StreamedPage(chunks, 'attendees')
+        assert page['extra'] == -2.5e-9
+        assert list(page['attendees']) == records
+        assert page['pagination'] == {'has_more_items': False}
+
+def pagination_last(pages, size=20):
+    """fetch() of streamed pages whose pagination comes after the records, as benchmarks/fake_api.py sends them"""
+    fetched = []
+
+    def fetch(continue_token):
+        number = int(continue_token or 0)
+        fetched.append(number)
+        records = [{'id': "{}-{}".format(number, index)} for index in range(size)]
+        pagination = {'continuation': str(number + 1)} if number + 1 < pages else {}
+        content = json.dumps({'attendees': records, 'pagination': pagination}).encode()
+
+        def chunks():
+            # Arriving over the network, so the records are still being read when the page is handed over
+            for index in range(0, len(content), 64):
+                time.sleep(0.001)
+                yield content[index:index + 64]
+
+        return StreamedPage(chunks(), 'attendees')
+
+    return fetch, fetched
+
+def read_all(fetch, prefetch):
+    """The ids of every record, read page by page like PageWriter does, failing instead of hanging"""
+    result = {}
+
+    def run():
+        try:
+            result['ids'] = [record['id'] for page in iter_pages(fetch, "", prefetch) for record in page['attendees']]
+        except BaseException as error:
+            result['error'] = error
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), "iter_pages hung"
+    return result
+
+@pytest.mark.parametrize("prefetch", [0, 1, 2])
+def test_pagination_after_the_records_loses_no_page(prefetch):
+    fetch, fetched = pagination_last(pages=30)
+    result = read_all(fetch, prefetch)
+    assert 'error' not in result
+    assert result['ids'] == ["{}-{}".format(number, index) for number in range(30) for index in range(20)]
+    assert fetched == list(range(30))
+
+def test_errors_of_the_prefetching_thread_reach_the_caller():
+    def fetch(continue_token):
+        if continue_token == "2":
+            raise ValueError("boom")
+        return {'attendees': [], 'pagination': {'continuation': str(int(continue_token or 0) + 1)}}
+
+    assert isinstance(read_all(fetch, 1)['error'], ValueError)
+
+def test_a_page_without_pagination_fails_instead_of_hanging():
+    assert isinstance(read_all(lambda continue_token: {'attendees': []}, 1)['error'], KeyError)
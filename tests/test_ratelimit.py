@@ -0,0 +1,96 @@
+import email.utils
+
+import requests
+
+from tap_eventbrite import ratelimit
+from tap_eventbrite.ratelimit import RateLimiter, calls_path, retry_after_delay
+
+class Clock():
+    """time.time() and time.sleep() of the ratelimit module, without waiting"""
+    def __init__(self, now=1000000.0):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+def response(headers):
+    result = requests.Response()
+    result.headers.update(headers)
+    return result
+
+def test_calls_over_the_hourly_limit_wait_for_the_oldest_to_leave_the_window(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    limiter = RateLimiter(calls_per_hour=2, calls_per_day=100)
+
+    assert limiter.reserve() == 0
+    clock.now += 10
+    assert limiter.reserve() == 0
+    # Nothing is recorded while the caller has to wait
+    assert limiter.reserve() == 3590
+    assert limiter.reserve() == 3590
+
+    assert limiter.acquire() == 3590
+    assert clock.slept == [3590]
+    assert limiter.reserve() == 10
+
+def test_the_daily_limit_holds_across_hours(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    limiter = RateLimiter(calls_per_hour=10, calls_per_day=3)
+
+    for hour in range(3):
+        assert limiter.reserve() == 0
+        clock.now += 3600
+    assert limiter.reserve() == 86400 - 3 * 3600
+
+def test_pause_holds_every_caller_back(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    limiter = RateLimiter()
+
+    limiter.pause(30)
+    limiter.pause(5)
+    assert limiter.reserve() == 30
+    clock.now += 30
+    assert limiter.reserve() == 0
+
+def test_retry_after_in_seconds_or_as_an_http_date(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+
+    assert retry_after_delay(response({})) is None
+    assert retry_after_delay(response({'Retry-After': "7"})) == 7
+    assert retry_after_delay(response({'Retry-After': "-3"})) == 0
+    assert retry_after_delay(response({'Retry-After': email.utils.formatdate(clock.now + 42, usegmt=True)})) == 42
+    assert retry_after_delay(response({'Retry-After': email.utils.formatdate(clock.now - 42, usegmt=True)})) == 0
+    assert retry_after_delay(response({'Retry-After': "soon"})) is None
+
+def test_the_calls_of_a_token_are_kept_between_runs(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    path = calls_path(str(tmp_path), "s3cr3t")
+    assert "s3cr3t" not in path
+
+    first = RateLimiter(calls_per_hour=3, calls_per_day=100, path=path)
+    first.reserve()
+    first.reserve()
+    first.save()
+
+    # Another run, saved in between
+    clock.now += 60
+    other = RateLimiter(calls_per_hour=3, calls_per_day=100, path=path)
+    assert other.reserve() == 0
+    assert other.reserve() == 3540
+    other.save()
+
+    # Calls older than a day are dropped from the file
+    clock.now += 86400 - 30
+    later = RateLimiter(calls_per_hour=1, calls_per_day=100, path=path)
+    assert len(later.windows[-1][2]) == 1
+    assert later.reserve() == 0
@@ -0,0 +1,89 @@
+import pytest
+
+from tap_eventbrite.client import EventbriteError
+from tap_eventbrite.sales_report import split_sales_report
+
+# The shape of a /reports/sales/?event_ids=1,2&group_by=event response
+GROUPED_REPORT = {
+    'data': [
+        {
+            'date': "2020-02-01T00:00:00",
+            'date_localized': "2020-02-01T00:00:00",
+            'totals': {'currency': "USD", 'gross': "30.00", 'net': "27.00", 'quantity': 3, 'fees': "3.00"},
+            'breakdown': [
+                {'name': "1", 'totals': {'currency': "USD", 'gross': "10.00", 'net': "9.00", 'quantity': 1, 'fees': "1.00"}},
+                {'name': "2", 'totals': {'currency': "USD", 'gross': "20.00", 'net': "18.00", 'quantity': 2, 'fees': "2.00"}},
+            ],
+        },
+    ],
+}
+
+def test_single_event_rows_get_the_event_id():
+    report = {'data': [{'date': "2020-02-01T00:00:00", 'totals': {'gross': "1.00"}}]}
+    rows = list(split_sales_report(report, ["7"]))
+    assert rows == [{'date': "2020-02-01T00:00:00", 'totals': {'gross': "1.00"}, 'event_id': "7"}]
+
+def test_grouped_report_is_split_by_breakdown_name():
+    rows = list(split_sales_report(GROUPED_REPORT, ["1", "2"]))
+    assert [(row['event_id'], row['totals']['gross']) for row in rows] == [("1", "10.00"), ("2", "20.00")]
+    assert all(row['date'] == "2020-02-01T00:00:00" for row in rows)
+
+def test_unknown_breakdown_stops_the_sync():
+    with pytest.raises(EventbriteError):
+        list(split_sales_report(GROUPED_REPORT, ["1", "3"]))
+
+def test_failed_call_yields_nothing():
+    assert list(split_sales_report(None, ["1", "2"])) == []
+
+def make_writer(state, events, loading_new_data=False):
+    import tap_eventbrite
+    schema = tap_eventbrite.load_schemas()['sales_reports']
+    return tap_eventbrite.SalesReportWriter(state, schema, tap_eventbrite.compile_schema(schema), 1, loading_new_data, events)
+
+def make_events():
+    from tap_eventbrite.event import EventIndex
+    events = EventIndex()
+    events.add({'id': "ended", 'start': {'utc': "2019-12-01T00:00:00Z"}, 'end': {'utc': "2020-01-01T00:00:00Z"}})
+    events.add({'id': "selling", 'start': {'utc': "2999-01-01T00:00:00Z"}, 'end': {'utc': "2999-01-02T00:00:00Z"}})
+    return events
+
+def test_ended_events_are_dropped_from_the_state():
+    state = {'bookmarks': {'sales_reports': {'event_dates': {
+        'ended': "2020-01-01T00:00:00", 'selling': "2020-06-01T00:00:00", 'deleted': "2020-01-01T00:00:00"}}}}
+    events = make_events()
+    make_writer(state, events).finish()
+
+    bookmark = state['bookmarks']['sales_reports']
+    assert bookmark['event_dates'] == {'selling': "2020-06-01T00:00:00"}
+    assert bookmark['ended_before'] is not None
+
+    # Not reported again, even by a full load
+    assert make_writer(state, events).batches == [["selling"]]
+
+def test_a_failed_report_keeps_ended_events():
+    state = {}
+    events = make_events()
+    writer = make_writer(state, events)
+    writer.write(["ended"], None)
+    writer.finish()
+
+    assert 'ended_before' not in state['bookmarks']['sales_reports']
+    assert make_writer(state, events).batches == [["ended"], ["selling"]]
+
+def test_a_daily_run_after_missed_runs_reports_the_events_that_ended_in_between():
+    import datetime
+    days_ago = lambda days: (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    from tap_eventbrite.event import EventIndex
+    events = EventIndex()
+    events.add({'id': "E", 'start': {'utc': days_ago(4)}, 'end': {'utc': days_ago(3)}})
+    state = {'bookmarks': {'sales_reports': {'ended_before': days_ago(6), 'event_dates': {}}}}
+
+    writer = make_writer(state, events, loading_new_data=True)
+    assert writer.batches == [["E"]]
+    # Every day since the last complete run, not only yesterday
+    assert writer.start_date(["E"]) == days_ago(6)[:10]
+
+    # A first daily run starts yesterday, a full load gets everything
+    import tap_eventbrite
+    assert make_writer({}, events, loading_new_data=True).start_date(["E"]) == tap_eventbrite.get_threshold_time_formatted()[:10]
+    assert make_writer(state, events).start_date(["E"]) is None
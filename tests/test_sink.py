@@ -0,0 +1,117 @@
+import glob
+import gzip
+import json
+import os
+
+import pytest
+import singer
+
+from tap_eventbrite import sink
+from tap_eventbrite.sink import FileSink, MANIFESTS
+
+SCHEMA = {'properties': {'id': {'type': ["null", "integer"]}, 'name': {'type': ["null", "string"]}}}
+
+def start(directory, file_format="ndjson", file_rows=sink.DEFAULT_FILE_ROWS, compresslevel=sink.DEFAULT_COMPRESSION_LEVEL):
+    file_sink = FileSink(str(directory), file_format, 4, file_rows, compresslevel)
+    file_sink.write_message(singer.SchemaMessage(stream="attendees", schema=SCHEMA, key_properties=['id']))
+    return file_sink
+
+def write(file_sink, ids):
+    for record_id in ids:
+        file_sink.write_record("attendees", {'id': record_id, 'name': "n{}".format(record_id)})
+
+def manifests(directory):
+    return [json.load(open(path)) for path in sorted(glob.glob(os.path.join(str(directory), "manifests", "*.json")))]
+
+def read(directory, manifest):
+    ids = []
+    for entry in manifest['files']:
+        path = os.path.join(str(directory), entry['path'])
+        if entry['format'] == "parquet":
+            import pyarrow.parquet
+            ids += pyarrow.parquet.read_table(path).column('id').to_pylist()
+        else:
+            ids += [json.loads(line)['id'] for line in gzip.open(path, 'rt')]
+    return ids
+
+def test_a_state_syncs_the_open_files_without_closing_them(tmp_path, capsys):
+    file_sink = start(tmp_path)
+    write(file_sink, range(10))
+    file_sink.write_message(singer.StateMessage(value={}))
+    write(file_sink, range(10, 20))
+    file_sink.write_message(singer.StateMessage(value={}))
+
+    manifest, = manifests(tmp_path)
+    assert manifest['files'] == []
+    assert [(entry['stream'], entry['rows']) for entry in manifest['open']] == [("attendees", 20)]
+
+    file_sink.close()
+    manifest, = manifests(tmp_path)
+    assert manifest['open'] == []
+    assert read(tmp_path, manifest) == list(range(20))
+    assert capsys.readouterr().out.count('"STATE"') == 2
+
+def test_files_roll_past_file_rows(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(sink, "WRITE_BATCH_SIZE", 5)
+    file_sink = start(tmp_path, file_rows=10)
+    write(file_sink, range(25))
+    file_sink.close()
+
+    manifest, = manifests(tmp_path)
+    assert [entry['rows'] for entry in manifest['files']] == [10, 10, 5]
+    assert read(tmp_path, manifest) == list(range(25))
+
+@pytest.mark.parametrize("compresslevel, extra_flags", [(sink.DEFAULT_COMPRESSION_LEVEL, 0), (1, 4), (9, 2)])
+def test_ndjson_files_are_gzipped_at_the_configured_level(tmp_path, compresslevel, extra_flags):
+    file_sink = start(tmp_path, compresslevel=compresslevel)
+    write(file_sink, range(10))
+    file_sink.close()
+
+    manifest, = manifests(tmp_path)
+    with open(os.path.join(str(tmp_path), manifest['files'][0]['path']), 'rb') as file:
+        # The XFL byte of the gzip header: 2 for level 9, 4 for level 1, 0 otherwise
+        assert file.read(10)[8] == extra_flags
+    assert read(tmp_path, manifest) == list(range(10))
+
+def test_a_compression_level_out_of_range_is_refused(tmp_path):
+    with pytest.raises(Exception, match="OUTPUT_COMPRESSION_LEVEL"):
+        start(tmp_path, compresslevel=10)
+
+@pytest.mark.parametrize("file_format", ["ndjson", "parquet"])
+def test_a_dead_run_keeps_what_its_last_state_covers(tmp_path, file_format, capsys):
+    if file_format == "parquet":
+        pytest.importorskip("pyarrow")
+
+    file_sink = start(tmp_path, file_format)
+    write(file_sink, range(10))
+    file_sink.write_message(singer.StateMessage(value={}))
+    # Written after the last STATE, then the run dies with the files open
+    write(file_sink, range(10, 2000))
+    file_sink.write_buffer("attendees")
+    # Dying releases the run's lock
+    file_sink.lock.close()
+
+    start(tmp_path, file_format).close()
+    dead, finished = sorted(manifests(tmp_path), key=lambda manifest: manifest['run_id'] != file_sink.run_id)
+    assert dead['open'] == []
+    assert read(tmp_path, dead) == list(range(10))
+    assert finished['files'] == []
+    assert glob.glob(os.path.join(str(tmp_path), "attendees", "*", "*.tmp")) == []
+
+def test_a_live_run_sharing_the_directory_is_left_alone(tmp_path, capsys):
+    live = start(tmp_path)
+    write(live, range(10))
+    live.write_message(singer.StateMessage(value={}))
+    write(live, range(10, 20))
+    live.write_buffer("attendees")
+
+    start(tmp_path).close()
+    manifest, = [manifest for manifest in manifests(tmp_path) if manifest['run_id'] == live.run_id]
+    assert manifest['files'] == []
+    assert [entry['rows'] for entry in manifest['open']] == [10]
+
+    write(live, range(20, 30))
+    live.close()
+    manifest, = [manifest for manifest in manifests(tmp_path) if manifest['run_id'] == live.run_id]
+    assert read(tmp_path, manifest) == list(range(30))
+    assert glob.glob(os.path.join(str(tmp_path), MANIFESTS, "*.lock")) == []
@@ -0,0 +1,64 @@
+import datetime
+
+from tap_eventbrite import streams
+from tap_eventbrite.streams import filter_window, get_threshold_time_formatted
+
+START = "2020-03-05T00:00:00Z"
+
+def ids(records):
+    return [record['id'] for record in records]
+
+def test_records_created_or_changed_in_the_window_are_kept():
+    records = [
+        {'id': "old", 'created': "2019-01-01T00:00:00Z", 'changed': "2020-03-04T23:59:59Z"},
+        {'id': "changed", 'created': "2019-01-01T00:00:00Z", 'changed': "2020-03-05T10:00:00Z"},
+        {'id': "created", 'created': "2020-03-05T10:00:00Z", 'changed': "2019-01-01T00:00:00Z"},
+    ]
+    kept, skipped = filter_window(records, START)
+    assert ids(kept) == ["changed", "created"]
+    assert skipped == 1
+
+def test_window_start_is_inclusive():
+    records = [
+        {'id': "at_start", 'created': "2019-01-01T00:00:00Z", 'changed': "2020-03-05T00:00:00Z"},
+        {'id': "just_before", 'created': "2019-01-01T00:00:00Z", 'changed': "2020-03-04T23:59:59Z"},
+    ]
+    kept, skipped = filter_window(records, START)
+    assert ids(kept) == ["at_start"]
+    assert skipped == 1
+
+def test_window_has_no_end():
+    records = [
+        {'id': "end_of_day", 'created': "2020-03-05T23:59:59Z", 'changed': "2020-03-05T23:59:59Z"},
+        {'id': "later", 'created': "2020-03-04T00:00:00Z", 'changed': "2030-01-01T00:00:00Z"},
+    ]
+    kept, skipped = filter_window(records, START)
+    assert ids(kept) == ["end_of_day", "later"]
+    assert skipped == 0
+
+def test_records_with_one_timestamp_are_judged_on_it():
+    records = [
+        {'id': "created_in", 'created': "2020-03-05T00:00:00Z"},
+        {'id': "created_out", 'created': "2020-03-04T23:59:59Z"},
+        {'id': "changed_in", 'changed': "2020-03-06T00:00:00Z"},
+        {'id': "changed_out", 'changed': "2020-03-01T00:00:00Z", 'created': None},
+        {'id': "none"},
+    ]
+    kept, skipped = filter_window(records, START)
+    assert ids(kept) == ["created_in", "changed_in", "none"]
+    assert skipped == 2
+
+def test_fractional_seconds_are_compared_on_the_second():
+    records = [{'id': "fraction", 'created': "2019-01-01T00:00:00Z", 'changed': "2020-03-05T00:00:00.123Z"}]
+    kept, skipped = filter_window(records, START)
+    assert ids(kept) == ["fraction"]
+    assert skipped == 0
+
+def test_threshold_is_the_zero_padded_start_of_yesterday(monkeypatch):
+    class FixedDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2021, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc)
+
+    monkeypatch.setattr(streams.datetime, "datetime", FixedDatetime)
+    assert get_threshold_time_formatted() == "2021-02-02T00:00:00Z"